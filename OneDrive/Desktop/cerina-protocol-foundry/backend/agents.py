@@ -1,13 +1,24 @@
 # backend/agents.py - ROBUST STRUCTURED OUTPUT + OPENROUTER IMPROVEMENTS
 import os
+import asyncio
+import atexit
 import json
+import math
 import re
-from typing import Any, Dict, Optional, Tuple
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Dict, Optional, Tuple, Union
 
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field, ValidationError
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; stdlib json parses the same inputs, just slower
+    _loads = json.loads
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,6 +29,16 @@ OPENROUTER_REFERRER = os.getenv("OPENROUTER_REFERRER", "http://localhost:3000")
 # Recommend a JSON-friendly model; allow override. This works well with JSON-style outputs.
 # If you have issues with availability, set OPENROUTER_MODEL in your .env.
 DEFAULT_MODEL = os.getenv("OPENROUTER_MODEL", "qwen/qwen-2.5-7b-instruct")
+# Cheaper model tried first for short drafts; reviews escalate to DEFAULT_MODEL when it
+# flags a problem or returns malformed output. Set to an empty string to disable.
+REVIEW_SMALL_MODEL = os.getenv("OPENROUTER_SMALL_MODEL", "qwen/qwen-2.5-1.5b-instruct")
+REVIEW_SMALL_MAX_CHARS = int(os.getenv("REVIEW_SMALL_MAX_CHARS", "4000"))
+# Score safety and clinical quality in ONE reviewer request (graph.py wires it in when
+# enabled); failures fall back to the two separate reviewers.
+REVIEW_COMBINED = os.getenv("REVIEW_COMBINED", "0").strip().lower() in ("1", "true", "yes", "on")
+# Bind a strict json_schema response_format to reviewer calls. Turn off for providers or
+# models that reject it; the prompt + repair parser still recover the verdict.
+REVIEW_JSON_SCHEMA = os.getenv("REVIEW_JSON_SCHEMA", "1").strip().lower() not in ("0", "false", "no", "off")
 
 if not OPENROUTER_API_KEY:
     print("⚠️  WARNING: OPENROUTER_API_KEY not found in .env file.")
@@ -27,31 +48,69 @@ else:
     MOCK_MODE = False
     print(f"✅ OpenRouter API key loaded. Using model: {DEFAULT_MODEL}")
 
-# --- Pydantic Models for Structured Output ---
-class SafetyReview(BaseModel):
+# --- Structured Output Models ---
+# Plain slotted dataclasses: every field is already coerced by the _map_to_* helpers,
+# so re-validating through Pydantic on each review would be pure overhead. Frozen because
+# cached verdicts and the placeholder instances below are shared between callers.
+@dataclass(frozen=True)
+class SafetyReview:
     """Safety review output model."""
-    reasoning: str = Field(description="Step-by-step reasoning for safety score")
-    score: int = Field(description="Safety score from 1 (unsafe) to 10 (safe)")
-    is_safe: bool = Field(description="Whether content is safe")
-    revision_notes: str = Field(description="Actionable feedback for safety improvements")
-
-class ClinicalCritique(BaseModel):
+    __slots__ = ("reasoning", "score", "is_safe", "revision_notes")
+    reasoning: str          # Step-by-step reasoning for safety score
+    score: int              # Safety score from 1 (unsafe) to 10 (safe)
+    is_safe: bool           # Whether content is safe
+    revision_notes: str     # Actionable feedback for safety improvements
+
+@dataclass(frozen=True)
+class ClinicalCritique:
     """Clinical critique output model."""
-    reasoning: str = Field(description="Clinical reasoning and analysis")
-    score: int = Field(description="Quality score from 1 (poor) to 10 (excellent)")
-    passes_critique: bool = Field(description="Meets clinical standards")
-    revision_notes: str = Field(description="Suggestions for clinical improvements")
+    __slots__ = ("reasoning", "score", "passes_critique", "revision_notes")
+    reasoning: str          # Clinical reasoning and analysis
+    score: int              # Quality score from 1 (poor) to 10 (excellent)
+    passes_critique: bool   # Meets clinical standards
+    revision_notes: str     # Suggestions for clinical improvements
+
+ReviewResult = Union[SafetyReview, ClinicalCritique]
+
+# Fixed placeholder verdicts, built once and shared (safe because reviews are frozen).
+_DEFAULT_SAFETY_REVIEW = SafetyReview(
+    reasoning="No structured output returned; defaulting.",
+    score=7,
+    is_safe=True,
+    revision_notes="Add the required disclaimer at the top. Avoid medical advice or diagnosis."
+)
+_DEFAULT_CLINICAL_CRITIQUE = ClinicalCritique(
+    reasoning="No structured output returned; defaulting.",
+    score=7,
+    passes_critique=True,
+    revision_notes="Add concrete steps and reflection questions to improve actionability."
+)
+_FAILED_SAFETY_REVIEW = SafetyReview(
+    reasoning="Review failed; defaulting conservative score.",
+    score=7,
+    is_safe=True,
+    revision_notes="Ensure disclaimer present; avoid medical advice and crisis content."
+)
+_FAILED_CLINICAL_CRITIQUE = ClinicalCritique(
+    reasoning="Critique failed; defaulting moderate score.",
+    score=7,
+    passes_critique=True,
+    revision_notes="Improve clarity of steps and reflection prompts."
+)
 
 # --- Utility: Robust JSON extraction/repair ---
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE | re.MULTILINE)
+
 def _extract_json(text: str) -> Optional[Dict[str, Any]]:
     """Extract a JSON object from a string, even if wrapped in prose/code fences."""
     if not text:
         return None
-    # Remove code fences
-    cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.IGNORECASE | re.MULTILINE)
+    # Remove code fences (skip the regex entirely for the common fence-free output)
+    stripped = text.strip()
+    cleaned = _FENCE_RE.sub("", stripped) if "```" in stripped else stripped
     # Try direct load
     try:
-        return json.loads(cleaned)
+        return _loads(cleaned)
     except Exception:
         pass
     # Fallback: extract substring between first { and last }
@@ -59,30 +118,99 @@ def _extract_json(text: str) -> Optional[Dict[str, Any]]:
         start = cleaned.find("{")
         end = cleaned.rfind("}")
         if start != -1 and end != -1 and end > start:
-            return json.loads(cleaned[start : end + 1])
+            return _loads(cleaned[start : end + 1])
     except Exception:
         return None
     return None
 
+_BOOL_MAP = {
+    "yes": True, "true": True, "y": True, "1": True, "present": True,
+    "no": False, "false": False, "n": False, "0": False, "none": False,
+    "absent": False, "minimal": False, "not present": False,
+}
+
 def _coerce_bool(v: Any) -> Optional[bool]:
     if isinstance(v, bool):
         return v
     if isinstance(v, (int, float)):
         return bool(v)
     if isinstance(v, str):
-        s = v.strip().lower()
-        if s in ["yes", "true", "y", "1", "present"]:
-            return True
-        if s in ["no", "false", "n", "0", "none", "absent", "minimal", "not present"]:
-            return False
+        return _BOOL_MAP.get(v.strip().casefold())
     return None
 
 def _safe_int(x: Any, default: int = 7) -> int:
+    # Fast paths for the shapes models actually return; the try/except is the fallback
+    if type(x) is int:
+        return x
+    if isinstance(x, float):
+        return int(x) if math.isfinite(x) else default
+    if isinstance(x, str):
+        s = x.strip()
+        if s.isdecimal() or (s[:1] == "-" and s[1:].isdecimal()):
+            return int(s)
     try:
         return int(x)
     except Exception:
         return default
 
+# --- Alt-key normalization ---
+# Models often use synonyms for our field names. Each alias maps to its canonical
+# field plus a priority; the truthy value with the best priority wins, matching the
+# old `raw.get(a) or raw.get(b) or ...` chains in a single pass over the dict.
+def _alias_table(groups: Dict[str, Tuple[str, ...]]) -> Dict[str, Tuple[str, int]]:
+    return {alias: (canon, rank) for canon, aliases in groups.items() for rank, alias in enumerate(aliases)}
+
+_REVISION_ALIASES = ("revision_notes", "improvements", "suggestions", "recommendations")
+
+_SAFETY_ALIASES = _alias_table({
+    "reasoning": ("reasoning", "analysis", "rationale", "notes", "explanation"),
+    "score": ("score", "safety_score", "rating"),
+    "is_safe": ("is_safe", "safe", "passes_safety"),
+    "revision_notes": _REVISION_ALIASES,
+})
+
+_CLINICAL_ALIASES = _alias_table({
+    "reasoning": ("reasoning", "analysis", "rationale", "notes"),
+    "score": ("score", "quality_score", "rating"),
+    "passes_critique": ("passes_critique", "approved", "pass", "passes"),
+    "revision_notes": _REVISION_ALIASES,
+})
+
+def _take_alias(aliases: Dict[str, Tuple[str, int]], key: str, value: Any,
+                found: Dict[str, Any], ranks: Dict[str, int]) -> bool:
+    """Record `value` under its canonical field if `key` is a known alias. Returns True if it was one."""
+    alias = aliases.get(key.strip().casefold())
+    if alias is None:
+        return False
+    canon, rank = alias
+    if value and rank < ranks.get(canon, len(aliases)):
+        found[canon] = value
+        ranks[canon] = rank
+    return True
+
+# Ordered (keywords, flag) rules for hazard keys; the first rule whose keywords all
+# appear in the lowercased key wins. "empower" also matches "disempowering".
+_FLAG_RULES = (
+    (("medical", "advice"), "medical_advice_or_diagnosis"),
+    (("crisis",), "crisis_content"),
+    (("self-harm",), "crisis_content"),
+    (("suicide",), "crisis_content"),
+    (("clinical", "overly"), "overly_clinical_language"),
+    (("clinical", "patholog"), "overly_clinical_language"),
+    (("disclaimer", "missing"), "missing_disclaimer"),
+    (("disclaimer", "present"), "disclaimer_present"),
+    (("tone", "empower"), "tone_empowering"),
+)
+
+@lru_cache(maxsize=256)
+def _classify_flag_key(key: str) -> Optional[str]:
+    """Map a raw response key to its hazard flag name (memoized; models reuse the same keys)."""
+    kl = key.lower().strip()
+    for tokens, flag in _FLAG_RULES:
+        if all(tok in kl for tok in tokens):
+            return flag
+    return None
+
 def _map_to_safety_review(raw: Dict[str, Any]) -> SafetyReview:
     """
     Map messy dicts into SafetyReview.
@@ -90,18 +218,7 @@ def _map_to_safety_review(raw: Dict[str, Any]) -> SafetyReview:
     """
     if raw is None:
         # default safe-ish placeholder
-        return SafetyReview(
-            reasoning="No structured output returned; defaulting.",
-            score=7,
-            is_safe=True,
-            revision_notes="Add the required disclaimer at the top. Avoid medical advice or diagnosis."
-        )
-
-    # Common alt keys that models return
-    alt_reasoning = raw.get("reasoning") or raw.get("analysis") or raw.get("rationale") or raw.get("notes") or raw.get("explanation")
-    alt_score = raw.get("score") or raw.get("safety_score") or raw.get("rating")
-    alt_is_safe = raw.get("is_safe") or raw.get("safe") or raw.get("passes_safety")
-    alt_rev = raw.get("revision_notes") or raw.get("improvements") or raw.get("suggestions") or raw.get("recommendations")
+        return _DEFAULT_SAFETY_REVIEW
 
     # Parse hazard flags if present (these are common from your error logs):
     flags = {
@@ -112,34 +229,31 @@ def _map_to_safety_review(raw: Dict[str, Any]) -> SafetyReview:
         "tone_empowering": None,
     }
 
-    # The model sometimes returns keys like "1_Medical_advice_or_diagnosis_language"
-    # Normalize and detect presence
+    # A single pass picks up both the alt keys models return for our fields and
+    # hazard-flag keys like "1_Medical_advice_or_diagnosis_language"
+    fields_found: Dict[str, Any] = {}
+    ranks: Dict[str, int] = {}
     for k, v in raw.items():
-        kl = str(k).lower().strip()
-        if "medical" in kl and "advice" in kl:
-            flags["medical_advice_or_diagnosis"] = _coerce_bool(v)
-        elif "crisis" in kl or "self-harm" in kl or "suicide" in kl:
-            flags["crisis_content"] = _coerce_bool(v)
-        elif "clinical" in kl and ("overly" in kl or "patholog" in kl):
-            flags["overly_clinical_language"] = _coerce_bool(v)
-        elif "disclaimer" in kl and ("missing" in kl or "present" in kl):
-            # If value says "No" missing disclaimer -> False
-            # If value says "Yes" missing -> True
-            # We'll interpret string via _coerce_bool, but invert if "present" is used
-            val = _coerce_bool(v)
-            if "missing" in kl:
-                flags["missing_disclaimer"] = val
-            elif "present" in kl:
-                flags["missing_disclaimer"] = False if val is True else (True if val is False else None)
-        elif "tone" in kl and ("empower" in kl or "disempower" in kl):
-            # Empowering tone => safe-ish
-            tone_val = _coerce_bool(v)
-            # If model says "empowering", that means True
-            # If says "disempowering" and tone_val True, we consider False
-            flags["tone_empowering"] = tone_val
-
-    # Derive missing fields
-    derived_is_safe = alt_is_safe
+        key = str(k)
+        if _take_alias(_SAFETY_ALIASES, key, v, fields_found, ranks):
+            continue
+        flag = _classify_flag_key(key)
+        if flag is None:
+            continue
+        val = _coerce_bool(v)
+        if flag == "disclaimer_present":
+            # "Disclaimer present: Yes" means the disclaimer is NOT missing
+            flags["missing_disclaimer"] = False if val is True else (True if val is False else None)
+        else:
+            flags[flag] = val
+
+    alt_reasoning = fields_found.get("reasoning")
+    alt_score = fields_found.get("score")
+    alt_is_safe = fields_found.get("is_safe")
+    alt_rev = fields_found.get("revision_notes")
+
+    # Derive missing fields; "no"/"false" strings must not count as truthy
+    derived_is_safe = _coerce_bool(alt_is_safe)
     if derived_is_safe is None:
         unsafe_signals = [
             flags["medical_advice_or_diagnosis"] is True,
@@ -148,18 +262,17 @@ def _map_to_safety_review(raw: Dict[str, Any]) -> SafetyReview:
         ]
         derived_is_safe = not any(unsafe_signals)
 
-    derived_score = _safe_int(alt_score, default=9 if derived_is_safe else 5)
-    # Adjust score using flags
+    # Cap the score using flags
+    score_caps = [_safe_int(alt_score, default=9 if derived_is_safe else 5)]
     if flags["medical_advice_or_diagnosis"] is True:
-        derived_score = min(derived_score, 5)
+        score_caps.append(5)
     if flags["crisis_content"] is True:
-        derived_score = min(derived_score, 4)
+        score_caps.append(4)
     if flags["missing_disclaimer"] is True:
-        derived_score = min(derived_score, 6)
-    if flags["overly_clinical_language"] is True:
-        derived_score = min(derived_score, 7)
-    if flags["tone_empowering"] is False:
-        derived_score = min(derived_score, 7)
+        score_caps.append(6)
+    if flags["overly_clinical_language"] is True or flags["tone_empowering"] is False:
+        score_caps.append(7)
+    derived_score = min(score_caps)
 
     derived_reasoning = alt_reasoning or "Assessed safety risks: medical advice, crisis content, disclaimers, tone, and clinical language."
     if not alt_rev:
@@ -178,37 +291,26 @@ def _map_to_safety_review(raw: Dict[str, Any]) -> SafetyReview:
     else:
         derived_rev = str(alt_rev)
 
-    # Final validation
-    try:
-        return SafetyReview(
-            reasoning=str(derived_reasoning),
-            score=_safe_int(derived_score, 7),
-            is_safe=bool(derived_is_safe),
-            revision_notes=str(derived_rev),
-        )
-    except ValidationError:
-        # Last resort defaults
-        return SafetyReview(
-            reasoning=str(derived_reasoning or "No reasoning provided."),
-            score=_safe_int(derived_score, 7),
-            is_safe=bool(derived_is_safe),
-            revision_notes=str(derived_rev or "Add the required disclaimer at the top."),
-        )
+    return SafetyReview(
+        reasoning=str(derived_reasoning),
+        score=_safe_int(derived_score, 7),
+        is_safe=bool(derived_is_safe),
+        revision_notes=str(derived_rev),
+    )
 
 def _map_to_clinical_critique(raw: Dict[str, Any]) -> ClinicalCritique:
     """Map messy dicts into ClinicalCritique with derivations."""
     if raw is None:
-        return ClinicalCritique(
-            reasoning="No structured output returned; defaulting.",
-            score=7,
-            passes_critique=True,
-            revision_notes="Add concrete steps and reflection questions to improve actionability."
-        )
+        return _DEFAULT_CLINICAL_CRITIQUE
 
-    alt_reasoning = raw.get("reasoning") or raw.get("analysis") or raw.get("rationale") or raw.get("notes")
-    alt_score = raw.get("score") or raw.get("quality_score") or raw.get("rating")
-    alt_pass = raw.get("passes_critique") or raw.get("approved") or raw.get("pass") or raw.get("passes")
-    alt_rev = raw.get("revision_notes") or raw.get("improvements") or raw.get("suggestions") or raw.get("recommendations")
+    fields_found: Dict[str, Any] = {}
+    ranks: Dict[str, int] = {}
+    for k, v in raw.items():
+        _take_alias(_CLINICAL_ALIASES, str(k), v, fields_found, ranks)
+    alt_reasoning = fields_found.get("reasoning")
+    alt_score = fields_found.get("score")
+    alt_pass = fields_found.get("passes_critique")
+    alt_rev = fields_found.get("revision_notes")
 
     derived_pass = alt_pass if isinstance(alt_pass, bool) else _coerce_bool(alt_pass)
     if derived_pass is None:
@@ -218,26 +320,18 @@ def _map_to_clinical_critique(raw: Dict[str, Any]) -> ClinicalCritique:
     derived_reasoning = alt_reasoning or "Evaluated CBT adherence, clarity, actionability, tone, and structure."
     derived_rev = alt_rev or "Clarify steps, include examples, and ensure a supportive tone."
 
-    try:
-        return ClinicalCritique(
-            reasoning=str(derived_reasoning),
-            score=_safe_int(derived_score, 7),
-            passes_critique=bool(derived_pass),
-            revision_notes=str(derived_rev)
-        )
-    except ValidationError:
-        return ClinicalCritique(
-            reasoning=str(derived_reasoning or "No reasoning provided."),
-            score=_safe_int(derived_score, 7),
-            passes_critique=bool(derived_pass),
-            revision_notes=str(derived_rev or "Clarify steps and add examples.")
-        )
+    return ClinicalCritique(
+        reasoning=str(derived_reasoning),
+        score=_safe_int(derived_score, 7),
+        passes_critique=bool(derived_pass),
+        revision_notes=str(derived_rev)
+    )
 
-def _repair_to_model(text: str, model_cls) -> BaseModel:
+def _repair_to_model(text: str, model_cls) -> ReviewResult:
     """
     Robust repair pipeline:
     1) Extract JSON object from text.
-    2) Map/derive fields to the target Pydantic model.
+    2) Map/derive fields to the target review model.
     """
     raw = _extract_json(text)
     if model_cls is SafetyReview:
@@ -247,17 +341,88 @@ def _repair_to_model(text: str, model_cls) -> BaseModel:
     else:
         raise ValueError("Unsupported model for repair")
 
+# --- Schema-constrained output ---
+_JSON_TYPES = {str: "string", int: "integer", bool: "boolean"}
+
+def _object_schema(model_cls) -> Dict[str, Any]:
+    model_fields = fields(model_cls)
+    return {
+        "type": "object",
+        "properties": {f.name: {"type": _JSON_TYPES[f.type]} for f in model_fields},
+        "required": [f.name for f in model_fields],
+        "additionalProperties": False,
+    }
+
+def _response_format(model_cls) -> Dict[str, Any]:
+    """OpenAI-style `json_schema` response_format derived from a review model's fields."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model_cls.__name__, "strict": True, "schema": _object_schema(model_cls)},
+    }
+
+def _combined_response_format() -> Dict[str, Any]:
+    """response_format for the fused reviewer: one object holding both verdicts."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "CombinedReview",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "safety": _object_schema(SafetyReview),
+                    "critique": _object_schema(ClinicalCritique),
+                },
+                "required": ["safety", "critique"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+def _exact_model(raw: Any, model_cls) -> Optional[ReviewResult]:
+    """Build `model_cls` directly from `raw` if it matches the schema exactly, else None."""
+    if isinstance(raw, dict) and len(raw) == len(model_cls.__slots__):
+        try:
+            if all(type(raw[f.name]) is f.type for f in fields(model_cls)):
+                return model_cls(**raw)
+        except KeyError:
+            pass
+    return None
+
+def _parse_review(text: str, model_cls) -> Tuple[ReviewResult, bool]:
+    """
+    Fast path for schema-conforming output: build the model straight from the JSON.
+    Anything that doesn't match the schema exactly goes through `_repair_to_model`.
+    Returns the review and whether repair was needed.
+    """
+    try:
+        result = _exact_model(_loads(text), model_cls)
+    except Exception:
+        result = None
+    if result is not None:
+        return result, False
+    return _repair_to_model(text, model_cls), True
+
+def _parse_combined_review(text: str) -> Tuple[SafetyReview, ClinicalCritique, bool, bool]:
+    """
+    Split the fused reviewer's {"safety": {...}, "critique": {...}} output into both models.
+    The two flags say whether each section was actually present (i.e. worth caching).
+    """
+    raw = _extract_json(text)
+    if not isinstance(raw, dict):
+        raw = {}
+    safety_raw = raw.get("safety")
+    critique_raw = raw.get("critique") or raw.get("clinical")
+    safety = _exact_model(safety_raw, SafetyReview) or _map_to_safety_review(
+        safety_raw if isinstance(safety_raw, dict) else {})
+    critique = _exact_model(critique_raw, ClinicalCritique) or _map_to_clinical_critique(
+        critique_raw if isinstance(critique_raw, dict) else {})
+    return safety, critique, isinstance(safety_raw, dict), isinstance(critique_raw, dict)
+
 # --- LLM setup ---
 if MOCK_MODE:
-    class MockLLM:
-        def __init__(self, model="mock-model", temperature=0.7, max_tokens=1024):
-            self.model_name = model
-            self.temperature = temperature
-            self.max_tokens = max_tokens
-
-        def invoke(self, input_data):
-            # Return a reasonable mock draft
-            exercise = """## CBT Thought Record Exercise (Mock Response)
+    # A reasonable mock draft, built once and shared by every mock call
+    _MOCK_EXERCISE = """## CBT Thought Record Exercise (Mock Response)
 **Disclaimer**: This is an educational exercise for self-reflection, not a substitute for professional therapy.
 ### Introduction
 Cognitive Behavioral Therapy teaches us to identify and challenge unhelpful thoughts.
@@ -268,42 +433,89 @@ Cognitive Behavioral Therapy teaches us to identify and challenge unhelpful thou
 ### Reflection Questions
 • What changed for you?
 """
-            return type('obj', (object,), {'content': exercise})()
+    _MOCK_RESPONSE = SimpleNamespace(content=_MOCK_EXERCISE)
+
+    class MockLLM:
+        def __init__(self, model="mock-model", temperature=0.7, max_tokens=1024):
+            self.model_name = model
+            self.temperature = temperature
+            self.max_tokens = max_tokens
+
+        def invoke(self, input_data):
+            return _MOCK_RESPONSE
+
+        async def ainvoke(self, input_data):
+            return _MOCK_RESPONSE
 
     llm_draft = MockLLM(temperature=0.7, max_tokens=2048)
     llm_review = MockLLM(temperature=0.2, max_tokens=512)
+    llm_review_small = None
     llm_supervisor = MockLLM(temperature=0.3, max_tokens=1024)
+    _SCHEMA_REJECTIONS: Tuple[type, ...] = ()
 else:
+    # Deferred so mock mode never pays for importing langchain_openai/httpx
+    import httpx
+    from langchain_openai import ChatOpenAI
+    from openai import BadRequestError
+
+    # A 400 on a constrained call may mean the provider doesn't support response_format
+    _SCHEMA_REJECTIONS = (BadRequestError,)
+
     # Separate LLMs for different roles for better determinism
     common_headers = {
         "HTTP-Referer": OPENROUTER_REFERRER,
         "X-Title": "Cerina Protocol Foundry",
     }
-
-    llm_draft = ChatOpenAI(
-        model=DEFAULT_MODEL,
-        temperature=0.7,
-        max_tokens=2048,
-        openai_api_key=OPENROUTER_API_KEY,
-        openai_api_base="https://openrouter.ai/api/v1",
-        default_headers=common_headers,
+    # Ask OpenRouter to cache the long, static system prompts so repeat calls
+    # only pay for the short per-draft suffix.
+    common_body = {"cache_control": {"type": "ephemeral"}}
+
+    # One pooled HTTP/2 client per I/O mode for every role, so TLS handshakes are amortized
+    # and concurrent reviewer calls multiplex over the same connection.
+    _shared_http = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=httpx.Timeout(60.0, connect=5.0),
     )
-    llm_review = ChatOpenAI(
-        model=DEFAULT_MODEL,
-        temperature=0.2,
-        max_tokens=900,
-        openai_api_key=OPENROUTER_API_KEY,
-        openai_api_base="https://openrouter.ai/api/v1",
-        default_headers=common_headers,
+    atexit.register(_shared_http.close)
+    # The async twin serves ainvoke/abatch (the graph nodes), which otherwise get a
+    # private AsyncClient per ChatOpenAI instance.
+    _shared_async_http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=httpx.Timeout(60.0, connect=5.0),
     )
-    llm_supervisor = ChatOpenAI(
-        model=DEFAULT_MODEL,
-        temperature=0.3,
-        max_tokens=1024,
-        openai_api_key=OPENROUTER_API_KEY,
-        openai_api_base="https://openrouter.ai/api/v1",
-        default_headers=common_headers,
+
+    def _close_async_http():
+        try:
+            asyncio.run(_shared_async_http.aclose())
+        except Exception:
+            pass  # Interpreter shutdown; the sockets are closed with the process anyway
+
+    atexit.register(_close_async_http)
+
+    def _make_llm(temperature: float, max_tokens: int, model: str = DEFAULT_MODEL) -> ChatOpenAI:
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            openai_api_key=OPENROUTER_API_KEY,
+            openai_api_base="https://openrouter.ai/api/v1",
+            default_headers=common_headers,
+            extra_body=common_body,
+            http_client=_shared_http,
+            http_async_client=_shared_async_http,
+            max_retries=2,
+        )
+
+    llm_draft = _make_llm(temperature=0.7, max_tokens=2048)
+    llm_review = _make_llm(temperature=0.2, max_tokens=512)
+    llm_review_small = (
+        _make_llm(temperature=0.2, max_tokens=512, model=REVIEW_SMALL_MODEL)
+        if REVIEW_SMALL_MODEL and REVIEW_SMALL_MODEL != DEFAULT_MODEL
+        else None
     )
+    llm_supervisor = _make_llm(temperature=0.3, max_tokens=1024)
     print(f"✅ LLMs configured for OpenRouter with model: {DEFAULT_MODEL}")
 
 # Export this for supervisor use in graph.py
@@ -312,9 +524,7 @@ llm = llm_supervisor
 print(f"✅ Agents initialized in {'MOCK' if MOCK_MODE else 'REAL'} mode")
 
 # --- Agent 1: Clinical Drafter ---
-def get_drafter_runnable():
-    """Create the drafting agent."""
-    few_shot_example = """
+_FEW_SHOT_EXAMPLE = """
 ## Example: The 'Courtroom of Your Mind' Exercise
 **Disclaimer**: This is an educational exercise for self-reflection, not a substitute for professional therapy.
 ### Introduction
@@ -329,8 +539,7 @@ When anxiety strikes, our thoughts can feel like facts...
 • How do you feel now?
 """.strip()
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", f"""You are a Senior CBT Therapist and Content Designer.
+_DRAFTER_SYSTEM_PROMPT = f"""You are a Senior CBT Therapist and Content Designer.
 
 CRITICAL RULES:
 1) ALWAYS start with: "**Disclaimer**: This is an educational exercise for self-reflection, not a substitute for professional therapy."
@@ -340,25 +549,26 @@ CRITICAL RULES:
 5) Keep steps practical and concrete.
 
 Example format:
-{few_shot_example}
+{_FEW_SHOT_EXAMPLE}
+
+Now create an exercise based on the user's intent and any provided revision instructions."""  # noqa
+
+@lru_cache(maxsize=1)
+def get_drafter_runnable():
+    """Create the drafting agent (built once and reused across nodes)."""
+    from langchain_core.prompts import ChatPromptTemplate
 
-Now create an exercise based on the user's intent and any provided revision instructions."""),  # noqa
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", _DRAFTER_SYSTEM_PROMPT),
         ("human", "User Intent: {user_intent}\n\nRevision Instructions: {revision_instructions}")
     ])
 
     return prompt | llm_draft
 
-# --- Robust Safety Guardian (no fragile structured_output) ---
-def get_safety_guardian_runnable():
-    """
-    Returns a runnable with .invoke({"draft": str}) that produces a SafetyReview Pydantic object
-    robustly, even if the model returns loosely structured JSON.
-    """
-    class SafetyGuardianRunnable:
-        def invoke(self, inputs: Dict[str, Any]):
-            draft = inputs.get("draft", "")
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are a Safety Guardian for mental health content.
+# --- Reviewer prompts ---
+_REVIEW_PROMPTS = {
+    "safety": (
+        """You are a Safety Guardian for mental health content.
 
 Analyze the draft for:
 - Medical advice or diagnosis language
@@ -368,42 +578,18 @@ Analyze the draft for:
 - Empowering vs disempowering tone
 
 Return a STRICT JSON object with EXACTLY these fields:
-{
+{{
   "reasoning": string,
   "score": integer (1-10),
   "is_safe": boolean,
   "revision_notes": string
-}
+}}
 
-Do not include extra keys, explanations, or code fences. Output JSON only."""),
-                ("human", "Draft to review:\n\n{draft}")
-            ])
-            try:
-                response = (prompt | llm_review).invoke({"draft": draft})
-                content = getattr(response, "content", str(response))
-                # Repair/validate to our model
-                return _repair_to_model(content, SafetyReview)
-            except Exception:
-                # Fallback default if LLM call fails entirely
-                return SafetyReview(
-                    reasoning="Review failed; defaulting conservative score.",
-                    score=7,
-                    is_safe=True,
-                    revision_notes="Ensure disclaimer present; avoid medical advice and crisis content."
-                )
-    return SafetyGuardianRunnable()
-
-# --- Robust Clinical Critic (no fragile structured_output) ---
-def get_clinical_critic_runnable():
-    """
-    Returns a runnable with .invoke({"draft": str}) that produces a ClinicalCritique Pydantic object
-    robustly, even if the model returns loosely structured JSON.
-    """
-    class ClinicalCriticRunnable:
-        def invoke(self, inputs: Dict[str, Any]):
-            draft = inputs.get("draft", "")
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are a Senior CBT Therapist reviewing exercise quality.
+Do not include extra keys, explanations, or code fences. Output JSON only.""",
+        "Draft to review:\n\n{draft}",
+    ),
+    "clinical": (
+        """You are a Senior CBT Therapist reviewing exercise quality.
 
 Evaluate for:
 - Adherence to CBT principles
@@ -413,29 +599,382 @@ Evaluate for:
 - Educational value
 
 Return a STRICT JSON object with EXACTLY these fields:
-{
+{{
   "reasoning": string,
   "score": integer (1-10),
   "passes_critique": boolean,
   "revision_notes": string
+}}
+
+Do not include extra keys, explanations, or code fences. Output JSON only.""",
+        "Draft to critique:\n\n{draft}",
+    ),
 }
+_REVIEW_MODELS = {"safety": SafetyReview, "clinical": ClinicalCritique}
+
+# Fused rubric: one request returns both verdicts, so the draft is prefilled once
+_REVIEW_PROMPTS["combined"] = (
+    """You are reviewing a CBT exercise draft in two roles at once.
+
+As the Safety Guardian for mental health content, analyze the draft for:
+- Medical advice or diagnosis language
+- Crisis content (self-harm, suicide)
+- Overly clinical or pathologizing language
+- Presence of the required disclaimer
+- Empowering vs disempowering tone
 
-Do not include extra keys, explanations, or code fences. Output JSON only."""),
-                ("human", "Draft to critique:\n\n{draft}")
-            ])
-            try:
-                response = (prompt | llm_review).invoke({"draft": draft})
-                content = getattr(response, "content", str(response))
-                # Repair/validate to our model
-                return _repair_to_model(content, ClinicalCritique)
-            except Exception:
-                # Fallback default if LLM call fails entirely
-                return ClinicalCritique(
-                    reasoning="Critique failed; defaulting moderate score.",
-                    score=7,
-                    passes_critique=True,
-                    revision_notes="Improve clarity of steps and reflection prompts."
-                )
-    return ClinicalCriticRunnable()
+As a Senior CBT Therapist reviewing exercise quality, evaluate for:
+- Adherence to CBT principles
+- Clarity and actionability
+- Empathetic tone
+- Logical structure and flow
+- Educational value
+
+Return a STRICT JSON object with EXACTLY these two keys:
+{{
+  "safety": {{
+    "reasoning": string,
+    "score": integer (1-10),
+    "is_safe": boolean,
+    "revision_notes": string
+  }},
+  "critique": {{
+    "reasoning": string,
+    "score": integer (1-10),
+    "passes_critique": boolean,
+    "revision_notes": string
+  }}
+}}
+
+Do not include extra keys, explanations, or code fences. Output JSON only.""",
+    "Draft to review:\n\n{draft}",
+)
+
+@lru_cache(maxsize=None)
+def _review_chain(role: str, small: bool = False, constrained: bool = True):
+    """
+    The compiled `prompt | llm_review` chain for a reviewer role (or the small-model
+    tier when `small`). Built (and the template parsed) once on first use rather
+    than on every review call. `constrained=False` skips the response_format binding.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    system_prompt, human_prompt = _REVIEW_PROMPTS[role]
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("human", human_prompt)
+    ])
+    reviewer = llm_review_small if small else llm_review
+    if MOCK_MODE or not constrained:
+        return prompt | reviewer
+    # Grammar-constrained decoding guarantees a parseable object for compatible models
+    if role == "combined":
+        # Two verdicts need roughly twice the single-review output budget
+        return prompt | reviewer.bind(response_format=_combined_response_format(), max_tokens=1024)
+    response_format = _response_format(_REVIEW_MODELS[role])
+    return prompt | reviewer.bind(response_format=response_format)
+
+# --- Review cache ---
+# Review/revise loops frequently re-score an identical draft (e.g. a no-op revision),
+# so parsed verdicts are memoized per (model, role, draft digest) to skip the round-trip.
+_REVIEW_CACHE_MAXSIZE = 512
+_review_cache: "OrderedDict[str, ReviewResult]" = OrderedDict()
+
+def _review_cache_key(role: str, draft: str) -> str:
+    # Collapse whitespace so a revision that only reflowed the text reuses the prior verdict
+    normalized = " ".join(draft.split())
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+    model_name = getattr(llm_review, "model_name", DEFAULT_MODEL)
+    return f"{model_name}:{role}:{digest}"
+
+def invalidate(draft: str) -> None:
+    """Drop any cached reviews for the given draft."""
+    for role in _REVIEW_MODELS:
+        _review_cache.pop(_review_cache_key(role, draft), None)
+
+
+def _store_review(key: str, result: ReviewResult, parsed: bool = True) -> ReviewResult:
+    """
+    Cache `result` for the draft. Verdicts repaired from an empty or unparseable reply
+    (`parsed=False`) are returned but not kept, so a retry still reaches the model.
+    """
+    if not parsed:
+        return result
+    _review_cache[key] = result
+    if len(_review_cache) > _REVIEW_CACHE_MAXSIZE:
+        _review_cache.popitem(last=False)
+    return result
+
+# --- Early-exit streaming ---
+class _JsonObjectTracker:
+    """Tracks brace depth across streamed chunks, ignoring braces inside JSON strings."""
+    __slots__ = ("depth", "started", "in_string", "escaped")
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> int:
+        """Return the offset just past the closing top-level brace in `chunk`, or -1."""
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.depth += 1
+                self.started = True
+            elif not self.started:
+                continue
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+def _chunk_text(chunk: Any) -> str:
+    content = getattr(chunk, "content", chunk)
+    return content if isinstance(content, str) else ""
+
+def _stream_until_json(chain, payload: Dict[str, Any]) -> str:
+    """
+    Stream the chain's output and stop as soon as a complete top-level JSON object
+    has arrived; closing the stream early cancels the rest of the generation.
+    """
+    tracker = _JsonObjectTracker()
+    parts = []
+    stream = chain.stream(payload)
+    try:
+        for chunk in stream:
+            text = _chunk_text(chunk)
+            end = tracker.feed(text)
+            if end != -1:
+                parts.append(text[:end])
+                break
+            parts.append(text)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return "".join(parts)
+
+async def _astream_until_json(chain, payload: Dict[str, Any]) -> str:
+    """Async counterpart of `_stream_until_json`."""
+    tracker = _JsonObjectTracker()
+    parts = []
+    stream = chain.astream(payload)
+    try:
+        async for chunk in stream:
+            text = _chunk_text(chunk)
+            end = tracker.feed(text)
+            if end != -1:
+                parts.append(text[:end])
+                break
+            parts.append(text)
+    finally:
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return "".join(parts)
+
+# --- Schema fallback ---
+# Tiers (small / default model) whose provider rejected response_format; those are
+# reviewed unconstrained from then on instead of failing every call.
+_schema_rejected: set = set()
+
+def _stream_review(role: str, payload: Dict[str, Any], small: bool = False) -> str:
+    """Stream a review, dropping the json_schema binding for good if the provider rejects it."""
+    if REVIEW_JSON_SCHEMA and small not in _schema_rejected:
+        try:
+            return _stream_until_json(_review_chain(role, small), payload)
+        except _SCHEMA_REJECTIONS as e:
+            content = _stream_until_json(_review_chain(role, small, constrained=False), payload)
+            _schema_rejected.add(small)  # The plain call worked, so the schema was the problem
+            print(f"⚠️ Reviewer rejected response_format ({e}); continuing without a JSON schema")
+            return content
+    return _stream_until_json(_review_chain(role, small, constrained=False), payload)
+
+async def _astream_review(role: str, payload: Dict[str, Any], small: bool = False) -> str:
+    """Async counterpart of `_stream_review`."""
+    if REVIEW_JSON_SCHEMA and small not in _schema_rejected:
+        try:
+            return await _astream_until_json(_review_chain(role, small), payload)
+        except _SCHEMA_REJECTIONS as e:
+            content = await _astream_until_json(_review_chain(role, small, constrained=False), payload)
+            _schema_rejected.add(small)
+            print(f"⚠️ Reviewer rejected response_format ({e}); continuing without a JSON schema")
+            return content
+    return await _astream_until_json(_review_chain(role, small, constrained=False), payload)
+
+# --- Two-tier review routing ---
+# Scores at or below this from the small model are re-checked by the default model
+_ESCALATION_SCORE = 6
+review_routing_stats = {"small": 0, "escalated": 0}
+
+def _use_small_reviewer(draft: str) -> bool:
+    return llm_review_small is not None and len(draft) <= REVIEW_SMALL_MAX_CHARS
+
+def _needs_escalation(result: ReviewResult, repaired: bool) -> bool:
+    passed = result.is_safe if isinstance(result, SafetyReview) else result.passes_critique
+    return repaired or not passed or result.score <= _ESCALATION_SCORE
+
+def _call_review(role: str, draft: str) -> ReviewResult:
+    """Run the reviewer for `role` against `draft`, reusing a cached verdict when available."""
+    key = _review_cache_key(role, draft)
+    cached = _review_cache.get(key)
+    if cached is not None:
+        return cached
+
+    model_cls = _REVIEW_MODELS[role]
+    payload = {"draft": draft}
+    if _use_small_reviewer(draft):
+        review_routing_stats["small"] += 1
+        try:
+            content = _stream_review(role, payload, small=True)
+            result, repaired = _parse_review(content, model_cls)
+            if not _needs_escalation(result, repaired):
+                return _store_review(key, result)
+        except Exception:
+            pass  # A failing small model simply escalates
+        review_routing_stats["escalated"] += 1
+
+    content = _stream_review(role, payload)
+    # Validate to our model, repairing loosely structured output if needed
+    result, repaired = _parse_review(content, model_cls)
+    return _store_review(key, result, _was_parsed(content, repaired))
+
+async def _acall_review(role: str, draft: str) -> ReviewResult:
+    """Async counterpart of `_call_review`; shares the same cache."""
+    key = _review_cache_key(role, draft)
+    cached = _review_cache.get(key)
+    if cached is not None:
+        return cached
+
+    model_cls = _REVIEW_MODELS[role]
+    payload = {"draft": draft}
+    if _use_small_reviewer(draft):
+        review_routing_stats["small"] += 1
+        try:
+            content = await _astream_review(role, payload, small=True)
+            result, repaired = _parse_review(content, model_cls)
+            if not _needs_escalation(result, repaired):
+                return _store_review(key, result)
+        except Exception:
+            pass  # A failing small model simply escalates
+        review_routing_stats["escalated"] += 1
+
+    content = await _astream_review(role, payload)
+    result, repaired = _parse_review(content, model_cls)
+    return _store_review(key, result, _was_parsed(content, repaired))
+
+def _was_parsed(content: str, repaired: bool) -> bool:
+    """True unless the verdict is pure defaults because no JSON object could be recovered."""
+    return not repaired or isinstance(_extract_json(content), dict)
+
+def _cached_pair(draft: str) -> Tuple[str, str, Optional[Tuple[SafetyReview, ClinicalCritique]]]:
+    safety_key = _review_cache_key("safety", draft)
+    clinical_key = _review_cache_key("clinical", draft)
+    safety = _review_cache.get(safety_key)
+    clinical = _review_cache.get(clinical_key)
+    pair = (safety, clinical) if safety is not None and clinical is not None else None
+    return safety_key, clinical_key, pair
+
+def _call_combined_review(draft: str) -> Tuple[SafetyReview, ClinicalCritique]:
+    """Score `draft` for safety and clinical quality in a single LLM request."""
+    safety_key, clinical_key, cached = _cached_pair(draft)
+    if cached is not None:
+        return cached
+    content = _stream_review("combined", {"draft": draft})
+    safety, critique, safety_ok, critique_ok = _parse_combined_review(content)
+    return _store_review(safety_key, safety, safety_ok), _store_review(clinical_key, critique, critique_ok)
+
+async def _acall_combined_review(draft: str) -> Tuple[SafetyReview, ClinicalCritique]:
+    """Async counterpart of `_call_combined_review`."""
+    safety_key, clinical_key, cached = _cached_pair(draft)
+    if cached is not None:
+        return cached
+    content = await _astream_review("combined", {"draft": draft})
+    safety, critique, safety_ok, critique_ok = _parse_combined_review(content)
+    return _store_review(safety_key, safety, safety_ok), _store_review(clinical_key, critique, critique_ok)
+
+# --- Robust Safety Guardian (no fragile structured_output) ---
+def _safety_invoke(inputs: Dict[str, Any]) -> SafetyReview:
+    try:
+        return _call_review("safety", inputs.get("draft", ""))
+    except Exception:
+        # Fallback default if LLM call fails entirely
+        return _FAILED_SAFETY_REVIEW
+
+async def _safety_ainvoke(inputs: Dict[str, Any]) -> SafetyReview:
+    try:
+        return await _acall_review("safety", inputs.get("draft", ""))
+    except Exception:
+        # Fallback default if LLM call fails entirely
+        return _FAILED_SAFETY_REVIEW
+
+@lru_cache(maxsize=1)
+def get_safety_guardian_runnable():
+    """
+    Returns a runnable with .invoke({"draft": str}) that produces a SafetyReview object
+    robustly, even if the model returns loosely structured JSON.
+    """
+    from langchain_core.runnables import RunnableLambda
+    return RunnableLambda(_safety_invoke, afunc=_safety_ainvoke, name="SafetyGuardian")
+
+# --- Robust Clinical Critic (no fragile structured_output) ---
+def _clinical_invoke(inputs: Dict[str, Any]) -> ClinicalCritique:
+    try:
+        return _call_review("clinical", inputs.get("draft", ""))
+    except Exception:
+        # Fallback default if LLM call fails entirely
+        return _FAILED_CLINICAL_CRITIQUE
+
+async def _clinical_ainvoke(inputs: Dict[str, Any]) -> ClinicalCritique:
+    try:
+        return await _acall_review("clinical", inputs.get("draft", ""))
+    except Exception:
+        # Fallback default if LLM call fails entirely
+        return _FAILED_CLINICAL_CRITIQUE
+
+@lru_cache(maxsize=1)
+def get_clinical_critic_runnable():
+    """
+    Returns a runnable with .invoke({"draft": str}) that produces a ClinicalCritique object
+    robustly, even if the model returns loosely structured JSON.
+    """
+    from langchain_core.runnables import RunnableLambda
+    return RunnableLambda(_clinical_invoke, afunc=_clinical_ainvoke, name="ClinicalCritic")
+
+# --- Fused Reviewer ---
+def _combined_invoke(inputs: Dict[str, Any]) -> Tuple[SafetyReview, ClinicalCritique]:
+    try:
+        return _call_combined_review(inputs.get("draft", ""))
+    except Exception:
+        # Fall back to the two separate reviewers (each has its own failure placeholder)
+        return _safety_invoke(inputs), _clinical_invoke(inputs)
+
+async def _combined_ainvoke(inputs: Dict[str, Any]) -> Tuple[SafetyReview, ClinicalCritique]:
+    try:
+        return await _acall_combined_review(inputs.get("draft", ""))
+    except Exception:
+        safety, clinical = await asyncio.gather(_safety_ainvoke(inputs), _clinical_ainvoke(inputs))
+        return safety, clinical
+
+@lru_cache(maxsize=1)
+def get_combined_reviewer_runnable():
+    """
+    Returns a runnable with .invoke({"draft": str}) that produces a
+    (SafetyReview, ClinicalCritique) tuple from ONE LLM request, halving reviewer
+    round-trips and prompt tokens compared to the two separate runnables.
+    """
+    from langchain_core.runnables import RunnableLambda
+    return RunnableLambda(_combined_invoke, afunc=_combined_ainvoke, name="CombinedReviewer")
 
 print("✅ All agent runnables created successfully")
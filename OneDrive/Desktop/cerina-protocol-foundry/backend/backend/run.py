@@ -16,15 +16,29 @@ if __name__ == "__main__":
         # Check if the API is available
         if hasattr(main, 'api'):
             import uvicorn
+            # Reload is opt-in for development; it re-imports the whole app on every
+            # save and cannot be combined with multiple workers.
+            reload = os.getenv("CERINA_RELOAD", "0") == "1"
+            workers = 1 if reload else int(os.getenv("CERINA_WORKERS", "1"))
+            if workers > 1:
+                # Tasks, /invoke coalescing and /stream subscribers live in per-process
+                # memory, so other workers would 404 on /state, /stream and /resume.
+                print(f"⚠️  CERINA_WORKERS={workers} is not supported yet: task state is per-process.")
+                print("⚠️  Starting a single worker instead.")
+                workers = 1
+            port = int(os.getenv("PORT", "8000"))
             print("\n" + "="*60)
             print("🚀 Starting Cerina Protocol Foundry Backend")
             print("="*60)
-            print(f"🌐 Server will be available at: http://localhost:8000")
-            print(f"📚 API Documentation: http://localhost:8000/docs")
-            print(f"⚡ Using reload mode for development")
+            print(f"🌐 Server will be available at: http://localhost:{port}")
+            print(f"📚 API Documentation: http://localhost:{port}/docs")
+            if reload:
+                print(f"⚡ Using reload mode for development")
+            else:
+                print(f"⚙️  Workers: {workers}")
             print("="*60)
             
-            uvicorn.run("main:api", host="0.0.0.0", port=8000, reload=True)
+            uvicorn.run("main:api", host="0.0.0.0", port=port, reload=reload, workers=workers)
         else:
             print("❌ No 'api' object found in main module")
     except Exception as e:
@@ -0,0 +1,78 @@
+# batching.py - coalesce concurrent agent calls into batched requests
+import asyncio
+import contextvars
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class BatchingRunnable:
+    """
+    Wraps an agent runnable so that `ainvoke` calls arriving within `max_wait` seconds
+    (e.g. from concurrent /invoke threads) are issued together through `abatch`.
+
+    The runnable is resolved through `factory` at dispatch time, so construction
+    errors surface inside the calling node exactly as a direct call would.
+    """
+
+    def __init__(self, factory: Callable[[], Any], max_batch: int = 16, max_wait: float = 0.02):
+        self.factory = factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: set = set()  # Strong refs so dispatch tasks aren't GC'd mid-flight
+
+    def invoke(self, inputs: Dict[str, Any]) -> Any:
+        return self.factory().invoke(inputs)
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        # Each event loop (e.g. one per asyncio.run in the CLI) gets its own queue/worker
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # Start from an empty context: a task copies its creator's contextvars, and the
+            # first caller's LangChain run config would otherwise leak into every batch
+            self._worker = contextvars.Context().run(loop.create_task, self._collect())
+        future = loop.create_future()
+        await self._queue.put((inputs, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next batch can form while this one is in flight
+            task = loop.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        payloads = [payload for payload, _ in batch]
+        try:
+            runnable = self.factory()
+            if hasattr(runnable, "abatch"):
+                results = await runnable.abatch(payloads, return_exceptions=True)
+            else:
+                results = await asyncio.gather(
+                    *(asyncio.to_thread(runnable.invoke, p) for p in payloads), return_exceptions=True
+                )
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():  # Caller was cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,99 @@
+# cache.py - deterministic LLM response cache shared by the graph nodes
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Protocol, Tuple
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Optional[str]: ...
+    def set(self, key: str, value: str, ttl: float) -> None: ...
+
+
+class InMemoryBackend:
+    """Process-local LRU with per-entry expiry."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class RedisBackend:
+    """Shared cache across workers/processes; requires the optional `redis` package."""
+
+    def __init__(self, url: str):
+        import redis
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self._client.set(key, value, ex=max(1, int(ttl)))
+
+
+class LLMCache:
+    """
+    Caches LLM text outputs keyed on a sha256 of the prompt payload, so byte-identical
+    requests (retries, reruns, repeated intents) skip the network call entirely.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = 3600.0, namespace: str = "cerina:llm"):
+        self.backend = backend
+        self.ttl = ttl
+        self.namespace = namespace
+        self.stats = {"hits": 0, "misses": 0}
+
+    def make_key(self, kind: str, payload: Any) -> str:
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return f"{self.namespace}:{kind}:{hashlib.sha256(blob.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            value = None  # A flaky backend should never fail the graph
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception:
+            pass
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+
+def _build_default_cache() -> LLMCache:
+    ttl = float(os.getenv("LLM_CACHE_TTL", "3600"))
+    redis_url = os.getenv("LLM_CACHE_REDIS_URL")
+    if redis_url:
+        try:
+            return LLMCache(RedisBackend(redis_url), ttl=ttl)
+        except Exception as e:
+            print(f"⚠️ Redis LLM cache unavailable ({e}); using in-memory cache")
+    return LLMCache(InMemoryBackend(int(os.getenv("LLM_CACHE_SIZE", "1024"))), ttl=ttl)
+
+
+llm_cache = _build_default_cache()
@@ -0,0 +1,21 @@
+# clock.py - cheap ISO timestamps for logs, task records and graph metadata
+import time
+from datetime import datetime, timezone
+
+_cached_second = -1
+_cached_iso = ""
+
+
+def now_iso() -> str:
+    """
+    Current UTC time as an ISO-8601 string (second resolution, "Z" suffix).
+
+    The formatted string is reused for every call within the same second, so hot
+    paths (status updates, event logs, node metadata) skip the datetime round-trip.
+    """
+    global _cached_second, _cached_iso
+    second = int(time.time())
+    if second != _cached_second:
+        _cached_iso = datetime.fromtimestamp(second, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        _cached_second = second
+    return _cached_iso
@@ -1,13 +1,37 @@
 # graph.py
 import os
-from typing import TypedDict, List, Dict, Any, Optional
+import asyncio
+from typing import Annotated, TypedDict, List, Dict, Any, Optional
+from langchain_core.prompts import ChatPromptTemplate
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.checkpoint.memory import MemorySaver
 import time
-from datetime import datetime
-from contextlib import ExitStack
+from contextlib import AsyncExitStack, ExitStack
 import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# --- Logging ---
+# Node logs are handed to a queue and written to stdout by a listener thread, so the
+# event loop never blocks on terminal I/O. Set CERINA_LOG_LEVEL=DEBUG for the banners.
+logger = logging.getLogger("cerina.graph")
+logger.setLevel(os.getenv("CERINA_LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+logger.addHandler(QueueHandler(_log_queue))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Banners are built once; the nodes only hand them to the logger
+_SEP = "=" * 60
+_SYNTHESIS_BANNER = f"\n{_SEP}\n🎯 SUPERVISOR SYNTHESIS NODE\n{_SEP}"
+_ROUTER_BANNER = f"\n{_SEP}\n🔄 SUPERVISOR ROUTER\n{_SEP}"
 
 # --- Agent Imports with proper error handling ---
 try:
@@ -15,6 +39,8 @@ try:
         get_drafter_runnable,
         get_safety_guardian_runnable,
         get_clinical_critic_runnable,
+        get_combined_reviewer_runnable,
+        REVIEW_COMBINED,
         llm  # Shared LLM for supervisor
     )
     print("✅ Successfully imported agents")
@@ -31,8 +57,33 @@ except ImportError as e:
     get_drafter_runnable = MockAgent
     get_safety_guardian_runnable = MockAgent
     get_clinical_critic_runnable = MockAgent
+    get_combined_reviewer_runnable = None
+    REVIEW_COMBINED = False
     llm = MockAgent()
 
+# Reviewer verdicts are already memoized per draft inside agents.py (only on success),
+# so the graph-level cache covers the drafter and supervisor calls.
+from cache import llm_cache
+from clock import now_iso
+from batching import BatchingRunnable
+
+def _prebuilt(factory):
+    """Build an agent once at import; if that fails, keep the factory so the node reports the error."""
+    try:
+        runnable = factory()
+    except Exception as e:
+        print(f"⚠️ Deferring {getattr(factory, '__name__', 'agent')} construction: {e}")
+        return factory
+    return lambda: runnable
+
+# Concurrent threads' calls to the same agent are coalesced into one abatch
+batched_drafter = BatchingRunnable(_prebuilt(get_drafter_runnable))
+batched_safety_guardian = BatchingRunnable(_prebuilt(get_safety_guardian_runnable))
+batched_clinical_critic = BatchingRunnable(_prebuilt(get_clinical_critic_runnable))
+batched_combined_reviewer = (
+    BatchingRunnable(_prebuilt(get_combined_reviewer_runnable)) if REVIEW_COMBINED else None
+)
+
 # --- State Definition ---
 class Review(TypedDict):
     agent: str
@@ -40,166 +91,212 @@ class Review(TypedDict):
     score: int
     reasoning: str
 
+# --- Reducers ---
+# The reviewers run as parallel branches, so every channel they write to needs a
+# reducer. Both are idempotent, so re-applying the same update is harmless.
+# Nodes return only their metadata delta; `_merge_dict` folds it in once per step.
+def _merge_reviews(current: List[Review], update: List[Review]) -> List[Review]:
+    """Keep the latest review per agent (a new iteration replaces the previous one)."""
+    merged = {r["agent"]: r for r in current or []}
+    merged.update((r["agent"], r) for r in update or [])
+    return list(merged.values())
+
+def _merge_dict(current: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    return {**(current or {}), **(update or {})}
+
 class GraphState(TypedDict):
     user_intent: str
     draft: str
     draft_history: List[str]
-    reviews: List[Review]
-    scores: Dict[str, int]
+    reviews: Annotated[List[Review], _merge_reviews]
+    scores: Annotated[Dict[str, int], _merge_dict]
     supervisor_feedback: str
     iteration_count: int
     human_approved: bool
     error: Optional[str]
-    metadata: Dict[str, Any]
+    metadata: Annotated[Dict[str, Any], _merge_dict]
+
+# --- Prompts ---
+# Parsed once at import; the node only fills in the per-iteration values.
+SYNTHESIS_PROMPT = ChatPromptTemplate.from_template("""
+As the Supervisor, synthesize this feedback for the Drafter.
+DRAFT ITERATION: {iteration}
+USER INTENT: {user_intent}
+SAFETY REVIEW (Score: {safety_score}/10): {safety_notes}
+CLINICAL REVIEW (Score: {clinical_score}/10): {clinical_notes}
+Create CLEAR, ACTIONABLE instructions for the next draft. Prioritize the most important changes.
+Format your response as bullet points starting with •.
+Instructions for Drafter:""")
 
 # --- Agent Nodes ---
-def drafting_node(state: GraphState) -> Dict[str, Any]:
+async def drafting_node(state: GraphState) -> Dict[str, Any]:
     """Node for creating/revising drafts."""
-    print(f"\n{'='*60}")
-    print(f"🧠 DRAFTING NODE - Iteration {state.get('iteration_count', 0) + 1}")
-    print(f"{'='*60}")
+    logger.debug("\n%s\n🧠 DRAFTING NODE - Iteration %d\n%s", _SEP, state.get("iteration_count", 0) + 1, _SEP)
     try:
-        drafter = get_drafter_runnable()
         if state.get("iteration_count", 0) == 0:
             revision_instructions = "Create the initial draft from the user intent."
         else:
             revision_instructions = state.get("supervisor_feedback", "Improve the draft based on previous feedback.")
         
-        print(f"📝 User Intent: {state['user_intent'][:100]}...")
-        print(f"📝 Revision Instructions: {revision_instructions[:100]}...")
+        logger.debug("📝 User Intent: %s...", state["user_intent"][:100])
+        logger.debug("📝 Revision Instructions: %s...", revision_instructions[:100])
         
         start_time = time.time()
-        response = drafter.invoke({
+        draft_inputs = {
             "user_intent": state["user_intent"],
             "revision_instructions": revision_instructions
-        })
+        }
+        cache_key = llm_cache.make_key("draft", draft_inputs)
+        draft_content = llm_cache.get(cache_key)
+        if draft_content is None:
+            response = await batched_drafter.ainvoke(draft_inputs)
+            draft_content = response.content if hasattr(response, 'content') else str(response)
+            llm_cache.set(cache_key, draft_content)
+        else:
+            logger.info("♻️ Reusing cached draft for identical intent and instructions")
         draft_time = time.time() - start_time
         
-        draft_content = response.content if hasattr(response, 'content') else str(response)
-        
-        print(f"✅ Draft generated in {draft_time:.2f}s")
-        print(f"📄 Draft length: {len(draft_content)} characters")
+        logger.info("✅ Draft generated in %.2fs (%d characters)", draft_time, len(draft_content))
         
         return {
             "draft": draft_content,
             "iteration_count": state.get("iteration_count", 0) + 1,
             "draft_history": state.get("draft_history", []) + [draft_content],
             "error": None,
-            "metadata": {**state.get("metadata", {}), "drafting_time": draft_time, "last_drafted": datetime.now().isoformat()}
+            "metadata": {"drafting_time": draft_time, "last_drafted": now_iso()}
         }
     except Exception as e:
-        print(f"❌ Drafting error: {e}")
+        logger.error("❌ Drafting error: %s", e)
         return {"draft": state.get("draft", ""), "error": f"Drafting error: {str(e)}"}
 
-def review_node(state: GraphState) -> Dict[str, Any]:
-    """Node for safety and clinical reviews."""
-    print(f"\n{'='*60}")
-    print(f"🔍 REVIEW NODE")
-    print(f"{'='*60}")
+async def _ainvoke(runnable, inputs: Any):
+    """Await `runnable.ainvoke`, falling back to a worker thread for sync-only runnables."""
+    if hasattr(runnable, "ainvoke"):
+        return await runnable.ainvoke(inputs)
+    return await asyncio.to_thread(runnable.invoke, inputs)
+
+def _as_review(result, agent: str, default_reasoning: str) -> Review:
+    """Flatten a reviewer result (or None after a failure) into the graph's Review dict."""
+    return {
+        "agent": agent,
+        "notes": getattr(result, 'revision_notes', "No notes"),
+        "score": getattr(result, 'score', 7),
+        "reasoning": getattr(result, 'reasoning', default_reasoning),
+    }
+
+async def _run_reviewer(runnable, agent: str, label: str, draft: str, default_reasoning: str):
+    """Invoke one reviewer, never raising; returns (review, review_time)."""
+    result = None
+    start_time = time.time()
     try:
-        safety_guardian = get_safety_guardian_runnable()
-        clinical_critic = get_clinical_critic_runnable()
-        draft_content = state["draft"]
-        print(f"📄 Reviewing draft of {len(draft_content)} characters")
+        result = await _ainvoke(runnable, {"draft": draft})
+    except Exception as e:
+        logger.warning("⚠️ %s review error (continuing): %s", label, e)
+    return _as_review(result, agent, default_reasoning), time.time() - start_time
 
-        start_time = time.time()
+async def safety_review_node(state: GraphState) -> Dict[str, Any]:
+    """Review branch: Safety Guardian. Runs in parallel with the clinical branch."""
+    logger.debug("🔍 SAFETY REVIEW - draft of %d characters", len(state["draft"]))
+    review, review_time = await _run_reviewer(
+        batched_safety_guardian, "SafetyGuardian", "Safety", state["draft"], "Safety review completed"
+    )
+    logger.info("📊 Safety Score: %s/10 (%.2fs)", review["score"], review_time)
+    return {
+        "reviews": [review], "scores": {"safety": review["score"]},
+        "metadata": {"safety_review_time": review_time, "last_reviewed": now_iso()}
+    }
 
-        # Handle each review independently; never fail the entire node if one reviewer trips
-        safety_notes = "No notes"
-        safety_score = 7
-        safety_reasoning = "Safety review completed"
-        try:
-            safety_result = safety_guardian.invoke({"draft": draft_content})
-            safety_notes = getattr(safety_result, 'revision_notes', safety_notes)
-            safety_score = getattr(safety_result, 'score', safety_score)
-            safety_reasoning = getattr(safety_result, 'reasoning', safety_reasoning)
-        except Exception as e:
-            print(f"⚠️ Safety review error (continuing): {e}")
-
-        clinical_notes = "No notes"
-        clinical_score = 7
-        clinical_reasoning = "Clinical review completed"
-        try:
-            clinical_result = clinical_critic.invoke({"draft": draft_content})
-            clinical_notes = getattr(clinical_result, 'revision_notes', clinical_notes)
-            clinical_score = getattr(clinical_result, 'score', clinical_score)
-            clinical_reasoning = getattr(clinical_result, 'reasoning', clinical_reasoning)
-        except Exception as e:
-            print(f"⚠️ Clinical review error (continuing): {e}")
-
-        review_time = time.time() - start_time
-        
-        reviews = [
-            {"agent": "SafetyGuardian", "notes": safety_notes, "score": safety_score, "reasoning": safety_reasoning},
-            {"agent": "ClinicalCritic", "notes": clinical_notes, "score": clinical_score, "reasoning": clinical_reasoning}
-        ]
-        scores = {"safety": safety_score, "clinical": clinical_score}
-        
-        print(f"✅ Reviews completed in {review_time:.2f}s")
-        print(f"📊 Safety Score: {scores['safety']}/10")
-        print(f"📊 Clinical Score: {scores['clinical']}/10")
-        
-        return {
-            "reviews": reviews, "scores": scores, "error": None,
-            "metadata": {**state.get("metadata", {}), "review_time": review_time, "last_reviewed": datetime.now().isoformat()}
-        }
+async def clinical_review_node(state: GraphState) -> Dict[str, Any]:
+    """Review branch: Clinical Critic. Runs in parallel with the safety branch."""
+    logger.debug("🔍 CLINICAL REVIEW - draft of %d characters", len(state["draft"]))
+    review, review_time = await _run_reviewer(
+        batched_clinical_critic, "ClinicalCritic", "Clinical", state["draft"], "Clinical review completed"
+    )
+    logger.info("📊 Clinical Score: %s/10 (%.2fs)", review["score"], review_time)
+    return {
+        "reviews": [review], "scores": {"clinical": review["score"]},
+        "metadata": {"clinical_review_time": review_time, "last_reviewed": now_iso()}
+    }
+
+async def combined_review_node(state: GraphState) -> Dict[str, Any]:
+    """Single-request review (REVIEW_COMBINED): both verdicts from one LLM round-trip."""
+    logger.debug("🔍 COMBINED REVIEW - draft of %d characters", len(state["draft"]))
+    safety = clinical = None
+    start_time = time.time()
+    try:
+        safety, clinical = await batched_combined_reviewer.ainvoke({"draft": state["draft"]})
     except Exception as e:
-        print(f"❌ Review error: {e}")
-        return {"reviews": state.get("reviews", []), "scores": state.get("scores", {}), "error": f"Review error: {str(e)}"}
+        logger.warning("⚠️ Combined review error (continuing): %s", e)
+    review_time = time.time() - start_time
+    safety_review = _as_review(safety, "SafetyGuardian", "Safety review completed")
+    clinical_review = _as_review(clinical, "ClinicalCritic", "Clinical review completed")
+    logger.info("📊 Safety Score: %s/10, Clinical Score: %s/10 (%.2fs)",
+                safety_review["score"], clinical_review["score"], review_time)
+    return {
+        "reviews": [safety_review, clinical_review],
+        "scores": {"safety": safety_review["score"], "clinical": clinical_review["score"]},
+        "metadata": {"combined_review_time": review_time, "last_reviewed": now_iso()}
+    }
+
+def fan_out_reviews(state: GraphState) -> List[Send]:
+    """Dispatch the fresh draft to both reviewers at once; LangGraph runs the branches concurrently."""
+    if REVIEW_COMBINED:
+        return [Send("combined_reviewer", state)]
+    return [Send("safety_reviewer", state), Send("clinical_reviewer", state)]
 
-def supervisor_synthesis_node(state: GraphState) -> Dict[str, Any]:
+async def supervisor_synthesis_node(state: GraphState) -> Dict[str, Any]:
     """Node for synthesizing feedback from both reviewers."""
-    print(f"\n{'='*60}")
-    print(f"🎯 SUPERVISOR SYNTHESIS NODE")
-    print(f"{'='*60}")
+    logger.debug(_SYNTHESIS_BANNER)
     try:
         reviews = state.get("reviews", [])
         if not reviews:
             return {"supervisor_feedback": "No feedback available. Continue with original intent."}
 
-        safety_review = next((r for r in reviews if r["agent"] == "SafetyGuardian"), {})
-        clinical_review = next((r for r in reviews if r["agent"] == "ClinicalCritic"), {})
+        by_agent = {r["agent"]: r for r in reviews}
+        safety_review = by_agent.get("SafetyGuardian", {})
+        clinical_review = by_agent.get("ClinicalCritic", {})
         
-        synthesis_prompt = f"""
-As the Supervisor, synthesize this feedback for the Drafter.
-DRAFT ITERATION: {state.get("iteration_count", 0)}
-USER INTENT: {state.get('user_intent', 'Not specified')}
-SAFETY REVIEW (Score: {safety_review.get('score', 'N/A')}/10): {safety_review.get('notes', 'No safety notes')}
-CLINICAL REVIEW (Score: {clinical_review.get('score', 'N/A')}/10): {clinical_review.get('notes', 'No clinical notes')}
-Create CLEAR, ACTIONABLE instructions for the next draft. Prioritize the most important changes.
-Format your response as bullet points starting with •.
-Instructions for Drafter:"""
+        prompt_values = {
+            "iteration": state.get("iteration_count", 0),
+            "user_intent": state.get('user_intent', 'Not specified'),
+            "safety_score": safety_review.get('score', 'N/A'),
+            "safety_notes": safety_review.get('notes', 'No safety notes'),
+            "clinical_score": clinical_review.get('score', 'N/A'),
+            "clinical_notes": clinical_review.get('notes', 'No clinical notes'),
+        }
         
-        print("🤔 Synthesizing feedback from reviewers...")
+        logger.debug("🤔 Synthesizing feedback from reviewers...")
         start_time = time.time()
-        response = llm.invoke(synthesis_prompt)
-        feedback = response.content if hasattr(response, 'content') else str(response)
+        cache_key = llm_cache.make_key("synthesis", prompt_values)
+        feedback = llm_cache.get(cache_key)
+        if feedback is None:
+            response = await _ainvoke(llm, SYNTHESIS_PROMPT.format_messages(**prompt_values))
+            feedback = response.content if hasattr(response, 'content') else str(response)
+            llm_cache.set(cache_key, feedback)
         synthesis_time = time.time() - start_time
         
-        print(f"✅ Feedback synthesized in {synthesis_time:.2f}s")
-        print(f"📋 Feedback: {feedback[:150]}...")
+        logger.info("✅ Feedback synthesized in %.2fs", synthesis_time)
+        logger.debug("📋 Feedback: %s...", feedback[:150])
         
         return {
             "supervisor_feedback": feedback, "error": None,
-            "metadata": {**state.get("metadata", {}), "synthesis_time": synthesis_time}
+            "metadata": {"synthesis_time": synthesis_time}
         }
     except Exception as e:
-        print(f"❌ Synthesis error: {e}")
+        logger.error("❌ Synthesis error: %s", e)
         return {"supervisor_feedback": "Error in synthesis.", "error": f"Synthesis error: {str(e)}"}
 
 # --- Router Logic ---
 def supervisor_router(state: GraphState) -> str:
     """Determine next step based on scores and iteration count."""
-    print(f"\n{'='*60}")
-    print(f"🔄 SUPERVISOR ROUTER")
-    print(f"{'='*60}")
+    logger.debug(_ROUTER_BANNER)
     
     if state.get("error"):
-        print(f"❌ Error detected: {state['error']} → Requesting human review")
+        logger.warning("❌ Error detected: %s → Requesting human review", state["error"])
         return "request_human_review"
     
     if state.get("human_approved", False):
-        print("✅ Human approved → Finalize")
+        logger.info("✅ Human approved → Finalize")
         return "finalize"
     
     scores = state.get("scores", {})
@@ -207,25 +304,42 @@ def supervisor_router(state: GraphState) -> str:
     clinical_score = scores.get("clinical", 0)
     iteration = state.get("iteration_count", 0)
     
-    print(f"📊 Scores - Safety: {safety_score}, Clinical: {clinical_score} | Iteration: {iteration}")
+    logger.info("📊 Scores - Safety: %s, Clinical: %s | Iteration: %s", safety_score, clinical_score, iteration)
     
     if safety_score >= 9 and clinical_score >= 8:
-        print("🎯 Decision: High scores → Request human review")
+        logger.info("🎯 Decision: High scores → Request human review")
         return "request_human_review"
     elif iteration >= 3 or safety_score < 6:
-        print("⏰ Decision: Max iterations or low safety score → Request human review")
+        logger.info("⏰ Decision: Max iterations or low safety score → Request human review")
         return "request_human_review"
     elif safety_score < 8 or clinical_score < 7:
-        print("🔧 Decision: Needs improvement → Revise")
+        logger.info("🔧 Decision: Needs improvement → Revise")
         return "revise"
     else:
-        print("🤔 Decision: Borderline scores → Request human review")
+        logger.info("🤔 Decision: Borderline scores → Request human review")
+        return "request_human_review"
+
+def after_synthesis(state: GraphState) -> str:
+    """Synthesis only runs on the revise path; hand its feedback to the drafter unless it failed."""
+    if state.get("error"):
+        logger.warning("❌ Error detected: %s → Requesting human review", state["error"])
         return "request_human_review"
+    return "revise"
+
+def after_human_review(state: GraphState) -> str:
+    """Approval wins over a stale error left by the run that was halted for review."""
+    if state.get("human_approved", False):
+        logger.info("✅ Human approved → Finalize")
+        return "finalize"
+    return supervisor_router(state)
+
+def review_gate_node(state: GraphState) -> Dict[str, Any]:
+    """Join point for the parallel reviewers; routing happens on its outgoing edges."""
+    return {}
 
 def human_review_halt_node(state: GraphState):
     """A node that simply prints a halt message."""
-    print("\n⏸️ GRAPH HALTED FOR HUMAN REVIEW")
-    print("   The API will now wait for a /resume request.")
+    logger.info("⏸️ GRAPH HALTED FOR HUMAN REVIEW - waiting for a /resume request")
     return state
 
 # --- Build the Graph (but don't compile yet) ---
@@ -233,32 +347,47 @@ def build_workflow():
     """Builds the StateGraph workflow object."""
     workflow = StateGraph(GraphState)
     workflow.add_node("drafter", drafting_node)
-    workflow.add_node("reviewer", review_node)
+    if REVIEW_COMBINED:
+        workflow.add_node("combined_reviewer", combined_review_node)
+    else:
+        workflow.add_node("safety_reviewer", safety_review_node)
+        workflow.add_node("clinical_reviewer", clinical_review_node)
+    workflow.add_node("review_gate", review_gate_node)
     workflow.add_node("supervisor_synthesis", supervisor_synthesis_node)
     workflow.add_node("human_review_halt", human_review_halt_node)
     
     workflow.set_entry_point("drafter")
-    workflow.add_edge("drafter", "reviewer")
-    workflow.add_edge("reviewer", "supervisor_synthesis")
+    # Fan out to both reviewers, then fan back in once both have finished
+    if REVIEW_COMBINED:
+        # One request scores both rubrics; the separate reviewers are its fallback
+        workflow.add_conditional_edges("drafter", fan_out_reviews, ["combined_reviewer"])
+        workflow.add_edge("combined_reviewer", "review_gate")
+    else:
+        workflow.add_conditional_edges("drafter", fan_out_reviews, ["safety_reviewer", "clinical_reviewer"])
+        workflow.add_edge(["safety_reviewer", "clinical_reviewer"], "review_gate")
     
+    # Route on the scores first; the synthesis LLM call is only worth making when
+    # its feedback will feed another drafting iteration.
+    route_map = {
+        "revise": "supervisor_synthesis",
+        "request_human_review": "human_review_halt",
+        "finalize": END
+    }
+    workflow.add_conditional_edges("review_gate", supervisor_router, route_map)
     workflow.add_conditional_edges(
         "supervisor_synthesis",
-        supervisor_router,
-        {
-            "revise": "drafter",
-            "request_human_review": "human_review_halt",
-            "finalize": END
-        }
+        after_synthesis,
+        {"revise": "drafter", "request_human_review": "human_review_halt"}
     )
     
     # After human review, we either finalize or end.
-    workflow.add_edge("human_review_halt", "supervisor_synthesis")
+    workflow.add_conditional_edges("human_review_halt", after_human_review, route_map)
     
     return workflow
 
-print("\n" + "="*60)
+print("\n" + _SEP)
 print("🏗️  INITIALIZING AND COMPILING LANGGRAPH WORKFLOW")
-print("="*60)
+print(_SEP)
 
 # Build the workflow definition
 workflow = build_workflow()
@@ -310,6 +439,49 @@ except Exception as e:
             pass
     graph_app = MockApp()
 
+# --- Async checkpointer ---
+# The sync SqliteSaver blocks the event loop on every checkpoint write inside astream.
+# Async entry points (FastAPI startup, MCP CLI) swap in an aiosqlite-backed saver once
+# a loop is running; until then the checkpointer above is used.
+_async_exit_stack: Optional[AsyncExitStack] = None
+_sync_checkpointer = None  # Restored when the async saver is closed
+
+async def setup_async_checkpointer():
+    """Attach an AsyncSqliteSaver to graph_app. Safe to call more than once."""
+    global _async_exit_stack, _sync_checkpointer
+    if _async_exit_stack is not None or not hasattr(graph_app, "checkpointer"):
+        return
+    stack = AsyncExitStack()
+    try:
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        saver = await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(db_path))
+        # WAL lets concurrent readers proceed while a checkpoint is being written
+        await saver.conn.execute("PRAGMA journal_mode=WAL")
+        await saver.conn.execute("PRAGMA synchronous=NORMAL")
+    except Exception as e:
+        try:
+            await stack.aclose()  # Don't leak a connection opened before the failure
+        except Exception:
+            pass
+        print(f"❌ Async SQLite checkpointer error: {e}")
+        print("⚠️ Keeping the existing checkpointer")
+        return
+    _sync_checkpointer = graph_app.checkpointer
+    graph_app.checkpointer = saver
+    _async_exit_stack = stack
+    print(f"✅ Async SQLite checkpointer configured for: {db_path}")
+
+async def close_async_checkpointer():
+    """Close the async saver (and its aiosqlite thread), falling back to the sync checkpointer."""
+    global _async_exit_stack
+    if _async_exit_stack is not None:
+        graph_app.checkpointer = _sync_checkpointer
+        try:
+            await _async_exit_stack.aclose()
+        except Exception:
+            pass
+        _async_exit_stack = None
+
 print("✅ Graph initialization complete!")
 
 
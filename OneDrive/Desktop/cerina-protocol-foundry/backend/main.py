@@ -1,30 +1,55 @@
 # *** main.py ***
 from fastapi import FastAPI, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import uuid
+import hashlib
 import asyncio
+import json
 import time
-from typing import Optional, Dict, Any
-from datetime import datetime
+from typing import Optional, Dict, Any, List
 import logging
+from collections import OrderedDict, deque
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    DefaultResponse = JSONResponse
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, default=str)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("cerina_api")
 
+_SEP = "=" * 60
+
+from cache import llm_cache
+from clock import now_iso
+
 # Import graph
 try:
-    from graph import graph_app
+    from graph import graph_app, setup_async_checkpointer, close_async_checkpointer
     print("✅ Successfully imported graph application")
 except ImportError as e:
     print(f"❌ Graph import error: {e}. Using mock graph.")
+    async def setup_async_checkpointer():
+        pass
+    async def close_async_checkpointer():
+        pass
     class MockGraphApp:
-        async def astream(self, *args, **kwargs): 
-            yield {"draft": "Mock draft", "iteration_count": 1}
+        async def astream(self, *args, stream_mode="values", **kwargs):
+            step = {"draft": "Mock draft", "iteration_count": 1}
+            yield ("values", step) if isinstance(stream_mode, list) else step
         async def aget_state(self, *args, **kwargs):
             return type('obj', (object,), {'values': {'draft': '# Mock Exercise'}, 'next': []})()
-        async def update_state(self, *args, **kwargs): 
+        async def aupdate_state(self, *args, **kwargs):
             pass
     graph_app = MockGraphApp()
 
@@ -33,8 +58,17 @@ api = FastAPI(
     title="Cerina Protocol Foundry API",
     description="Multi-agent CBT exercise generation system",
     version="2.0.0",
+    default_response_class=DefaultResponse,
 )
 
+@api.on_event("startup")
+async def on_startup():
+    await setup_async_checkpointer()
+
+@api.on_event("shutdown")
+async def on_shutdown():
+    await close_async_checkpointer()
+
 api.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
@@ -59,44 +93,121 @@ class APIResponse(BaseModel):
     data: Optional[Dict[str, Any]] = None
 
 # --- Task Management ---
+def _is_terminal(status: str) -> bool:
+    """True once a run has stopped: halted for review, finished, rejected, failed or evicted."""
+    return status in ("halted", "completed", "rejected", "evicted") or status.startswith("error")
+
+def _is_finished(status: str) -> bool:
+    """Terminal and not awaiting anyone: safe to forget before halted or running tasks."""
+    return status in ("completed", "rejected") or status.startswith("error")
+
+def _intent_key(intent: str) -> str:
+    return hashlib.sha256(intent.encode("utf-8")).hexdigest()
+
 class TaskManager:
+    """
+    In-memory task registry. No lock: every access runs on the event loop thread, and
+    each task has a single writer (the background job for its thread_id), so updates
+    are plain dict mutations. Stream clients get status changes through subscribe().
+
+    Both the registry and the event log are bounded: the least recently updated task
+    is evicted past MAX_TASKS, and only the newest MAX_LOGS events are kept.
+    """
+    MAX_TASKS = 1000
+    MAX_LOGS = 10000
+
     def __init__(self):
-        self.tasks: Dict[str, Dict[str, Any]] = {}
-        self.lock = asyncio.Lock()
-        self.task_logs: list = []
+        self.tasks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        # Single-flight map: sha256(intent) -> thread_id of the run currently producing it
+        self._inflight: Dict[str, str] = {}
+        self._inflight_keys: Dict[str, str] = {}
+        self.task_logs: deque = deque(maxlen=self.MAX_LOGS)
+        self._log_seq = 0
 
     async def create_task(self, thread_id: str, intent: str):
-        async with self.lock:
-            self.tasks[thread_id] = {
-                "status": "pending",
-                "intent": intent,
-                "created_at": datetime.now().isoformat(),
-                "last_update": datetime.now().isoformat(),
-                "state": None
-            }
-    
+        now = now_iso()
+        self.tasks[thread_id] = {
+            "status": "pending",
+            "intent": intent,
+            "created_at": now,
+            "last_update": now,
+            "state": None
+        }
+        self.tasks.move_to_end(thread_id)
+        if len(self.tasks) > self.MAX_TASKS:
+            self._evict(self._eviction_candidate())
+
     async def update_task_status(self, thread_id: str, status: str, state: Optional[Dict] = None):
-        async with self.lock:
-            if thread_id in self.tasks:
-                self.tasks[thread_id]["status"] = status
-                self.tasks[thread_id]["last_update"] = datetime.now().isoformat()
-                if state is not None:
-                    self.tasks[thread_id]["state"] = state
+        task = self.tasks.get(thread_id)
+        if task is None:
+            return
+        task["status"] = status
+        task["last_update"] = now_iso()
+        self.tasks.move_to_end(thread_id)
+        if state is not None:
+            task["state"] = state
+        if _is_terminal(status):
+            key = self._inflight_keys.pop(thread_id, None)
+            if key is not None and self._inflight.get(key) == thread_id:
+                del self._inflight[key]
+        self.publish(thread_id, {"type": "status", "status": status})
+
+    def _eviction_candidate(self) -> str:
+        """Least recently updated finished task; only if none exist, the oldest task overall."""
+        for thread_id, task in self.tasks.items():
+            if _is_finished(task["status"]):
+                return thread_id
+        return next(iter(self.tasks))
+
+    def _evict(self, thread_id: str):
+        """Forget a task and its bookkeeping; stream clients are told it is gone."""
+        self.publish(thread_id, {"type": "status", "status": "evicted"})
+        self._subscribers.pop(thread_id, None)
+        self.tasks.pop(thread_id, None)
+        key = self._inflight_keys.pop(thread_id, None)
+        if key is not None and self._inflight.get(key) == thread_id:
+            del self._inflight[key]
+
+    def find_inflight(self, intent: str) -> Optional[str]:
+        """Thread id of a run already in progress for this exact intent, if any."""
+        return self._inflight.get(_intent_key(intent))
+
+    def register_inflight(self, thread_id: str, intent: str):
+        key = _intent_key(intent)
+        self._inflight[key] = thread_id
+        self._inflight_keys[thread_id] = key
 
     async def get_task(self, thread_id: str):
-        async with self.lock:
-            return self.tasks.get(thread_id)
+        return self.tasks.get(thread_id)
+
+    def subscribe(self, thread_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(thread_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, thread_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(thread_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self._subscribers.pop(thread_id, None)
+
+    def publish(self, thread_id: str, event: Dict[str, Any]):
+        for queue in self._subscribers.get(thread_id, ()):
+            queue.put_nowait(event)
 
     def get_all_tasks(self) -> Dict[str, Dict]:
         return self.tasks
 
     def log_event(self, thread_id: str, action: str, details: str = ""):
+        self._log_seq += 1
         log_entry = {
-            "id": len(self.task_logs) + 1,
+            "id": self._log_seq,
             "thread_id": thread_id,
             "action": action,
             "details": details,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         }
         self.task_logs.append(log_entry)
         logger.info(f"LOG [{thread_id}]: {action} - {details}")
@@ -108,6 +219,7 @@ async def execute_graph(thread_id: str, intent: str):
     logger.info(f"🚀 Starting graph execution: thread={thread_id}")
     await task_manager.update_task_status(thread_id, "running")
     config = {"configurable": {"thread_id": thread_id}}
+    created_at = now_iso()
     
     initial_state = {
         "user_intent": intent,
@@ -119,22 +231,28 @@ async def execute_graph(thread_id: str, intent: str):
         "reviews": [],
         "scores": {},
         "error": None,
-        "metadata": {"created_at": datetime.now().isoformat(), "intent": intent}
+        "metadata": {"created_at": created_at, "intent": intent}
     }
     
     try:
         final_state = None
-        async for step in graph_app.astream(initial_state, config, stream_mode="values"):
-            final_state = step
+        interrupted = False
+        async for mode, chunk in graph_app.astream(initial_state, config, stream_mode=["values", "updates"]):
+            if mode == "values":
+                final_state = chunk
+                task_manager.publish(thread_id, {"type": "step", "state": chunk})
+            elif "__interrupt__" in chunk:
+                # interrupt_before=['human_review_halt'] ends the stream BEFORE that node runs
+                interrupted = True
 
-        # After stream finishes, check if we halted before 'human_review_halt'
-        # When using interrupt_before=['human_review_halt'], the stream ends BEFORE that node runs.
-        try:
-            snapshot = await graph_app.aget_state(config)
-            next_nodes = getattr(snapshot, "next", None)
-        except Exception as e:
-            logger.warning(f"Could not get state from graph checkpointer for {thread_id}: {e}")
-            next_nodes = None
+        next_nodes = ("human_review_halt",) if interrupted else None
+        if not interrupted:
+            # Older LangGraph releases don't report static interrupts in the stream; ask the checkpointer
+            try:
+                snapshot = await graph_app.aget_state(config)
+                next_nodes = getattr(snapshot, "next", None)
+            except Exception as e:
+                logger.warning(f"Could not get state from graph checkpointer for {thread_id}: {e}")
 
         if next_nodes and "human_review_halt" in next_nodes:
             logger.warning(f"⏸️ Graph halted for human review: thread={thread_id}")
@@ -155,7 +273,11 @@ async def root():
 
 @api.get("/health", response_model=APIResponse)
 async def health_check():
-    return APIResponse(success=True, message="Service is healthy", data={"active_tasks": len(task_manager.tasks)})
+    return APIResponse(
+        success=True,
+        message="Service is healthy",
+        data={"active_tasks": len(task_manager.tasks), "llm_cache": llm_cache.get_stats()}
+    )
 
 @api.get("/tasks", response_model=APIResponse)
 async def get_all_tasks():
@@ -167,10 +289,20 @@ async def invoke_graph_endpoint(request: InvokeRequest, background_tasks: Backgr
     if not request.intent.strip():
         raise HTTPException(status_code=400, detail="Intent cannot be empty")
     
+    intent = request.intent.strip()
+    if not request.thread_id:
+        # Identical intent already running: share its thread instead of paying for a second run
+        existing = task_manager.find_inflight(intent)
+        if existing:
+            task_manager.log_event(existing, "invoke_coalesced", "Joined an in-flight run with the same intent")
+            return APIResponse(success=True, message="Joined in-flight graph execution", data={"thread_id": existing})
+
     thread_id = request.thread_id or f"thread_{uuid.uuid4().hex[:8]}"
-    await task_manager.create_task(thread_id, request.intent.strip())
+    await task_manager.create_task(thread_id, intent)
+    if not request.thread_id:
+        task_manager.register_inflight(thread_id, intent)
     
-    background_tasks.add_task(execute_graph, thread_id, request.intent.strip())
+    background_tasks.add_task(execute_graph, thread_id, intent)
     
     return APIResponse(success=True, message="Graph execution started", data={"thread_id": thread_id})
 
@@ -201,6 +333,30 @@ async def get_state(thread_id: str):
         }
     )
 
+@api.get("/stream/{thread_id}")
+async def stream_state(thread_id: str):
+    """Server-Sent Events feed of graph steps and status changes until the task halts or ends."""
+    task = await task_manager.get_task(thread_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"Thread '{thread_id}' not found")
+
+    queue = task_manager.subscribe(thread_id)
+
+    async def event_generator():
+        try:
+            yield f"data: {_dumps({'type': 'status', 'status': task['status']})}\n\n"
+            if _is_terminal(task["status"]):
+                return
+            while True:
+                event = await queue.get()
+                yield f"data: {_dumps(event)}\n\n"
+                if event["type"] == "status" and _is_terminal(event["status"]):
+                    return
+        finally:
+            task_manager.unsubscribe(thread_id, queue)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 @api.post("/resume/{thread_id}", response_model=APIResponse)
 async def resume_graph(thread_id: str, request: ResumeRequest, background_tasks: BackgroundTasks):
     task = await task_manager.get_task(thread_id)
@@ -223,12 +379,14 @@ async def resume_graph(thread_id: str, request: ResumeRequest, background_tasks:
             try:
                 await task_manager.update_task_status(thread_id, "resuming")
                 # 1. Update the state in the checkpointer
-                await graph_app.update_state(config, update_state)
+                # Async API: the AsyncSqliteSaver rejects sync calls from the event-loop thread
+                await graph_app.aupdate_state(config, update_state)
                 
                 # 2. Continue the stream with None as input
                 final_state = None
                 async for step in graph_app.astream(None, config, stream_mode="values"):
                     final_state = step
+                    task_manager.publish(thread_id, {"type": "step", "state": step})
                 
                 logger.info(f"✅ Graph resumed and completed: thread={thread_id}")
                 await task_manager.update_task_status(thread_id, "completed", state=final_state)
@@ -245,13 +403,13 @@ async def resume_graph(thread_id: str, request: ResumeRequest, background_tasks:
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    print("\n" + "="*60)
+    print("\n" + _SEP)
     print("🚀 CERINA PROTOCOL FOUNDRY - BACKEND API")
-    print("="*60)
+    print(_SEP)
     print("📡 Starting server... (Press CTRL+C to stop)")
     # Note: 0.0.0.0 is a bind address; open http://localhost:8000 in your browser
     print(f"🌐 API URL: http://localhost:8000")
     print(f"📚 Docs:    http://localhost:8000/docs")
-    print("="*60 + "\n")
+    print(_SEP + "\n")
     
     uvicorn.run("main:api", host="0.0.0.0", port=8000, reload=True)
@@ -1,12 +1,16 @@
 import asyncio
 import sys
+import uuid
 import json
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
+from clock import now_iso
+
+_SEP = "=" * 60
 
 # Import the graph
 try:
-    from graph import graph_app
+    from graph import graph_app, setup_async_checkpointer, close_async_checkpointer
     print("✅ MCP Server: Graph module imported")
 except ImportError as e:
     print(f"❌ MCP Server: Graph import error: {e}")
@@ -23,6 +27,8 @@ async def process_mcp_request(user_intent: str, thread_id: str = None) -> Dict[s
     print(f"📋 Thread ID: {thread_id}")
     
     config = {"configurable": {"thread_id": thread_id}}
+    await setup_async_checkpointer()
+    processed_at = now_iso()
     
     # Initial state - human_approved is True for automated processing
     initial_state = {
@@ -37,7 +43,7 @@ async def process_mcp_request(user_intent: str, thread_id: str = None) -> Dict[s
         "error": None,
         "metadata": {
             "source": "mcp_server",
-            "processed_at": datetime.now().isoformat(),
+            "processed_at": processed_at,
             "automated": True
         }
     }
@@ -72,7 +78,7 @@ async def process_mcp_request(user_intent: str, thread_id: str = None) -> Dict[s
                 "iterations": iterations,
                 "scores": final_state.get("scores", {}),
                 "reviews": final_state.get("reviews", []),
-                "processing_time": datetime.now().isoformat(),
+                "processing_time": now_iso(),
                 "status": "completed"
             }
             
@@ -101,12 +107,32 @@ async def process_mcp_request(user_intent: str, thread_id: str = None) -> Dict[s
             "status": "error"
         }
 
+async def process_batch(intents: List[str]) -> List[Dict[str, Any]]:
+    """
+    Process several intents concurrently. Each gets its own thread_id so checkpoints
+    don't collide within or across batches; the LLM calls of the different runs overlap.
+    """
+    await setup_async_checkpointer()  # Once, before the runs race to set it up
+    # Checkpoints persist in SQLite, so ids must also differ from earlier batches
+    batch_id = uuid.uuid4().hex[:8]
+    return await asyncio.gather(*(
+        process_mcp_request(intent, thread_id=f"mcp_batch_{batch_id}_{idx}")
+        for idx, intent in enumerate(intents)
+    ))
+
+async def _closing_checkpointer(coro):
+    """Run a CLI entry point, then close the async checkpointer before the loop goes away."""
+    try:
+        return await coro
+    finally:
+        await close_async_checkpointer()
+
 # --- Command-line Interface ---
 async def interactive_cli():
     """Interactive command-line interface."""
-    print("\n" + "="*60)
+    print("\n" + _SEP)
     print("🤖 CERINA MCP SERVER - Automated Processing")
-    print("="*60)
+    print(_SEP)
     print("\nEnter CBT exercise intents (or 'quit' to exit):")
     
     while True:
@@ -125,11 +151,11 @@ async def interactive_cli():
             result = await process_mcp_request(user_input)
             
             if result["success"]:
-                print("\n" + "="*60)
+                print("\n" + _SEP)
                 print("📄 FINAL DRAFT")
-                print("="*60)
+                print(_SEP)
                 print(result["draft"])
-                print("\n" + "="*60)
+                print("\n" + _SEP)
                 
                 # Ask if user wants to save
                 save = input("\n💾 Save to file? (y/n): ").strip().lower()
@@ -150,10 +176,26 @@ async def interactive_cli():
 # --- Main Execution ---
 if __name__ == "__main__":
     # Check command line arguments
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2 and sys.argv[1] == "--file":
+        # Process a file of intents (one per line) concurrently
+        with open(sys.argv[2], encoding="utf-8") as f:
+            intents = [line.strip() for line in f if line.strip()]
+        results = asyncio.run(_closing_checkpointer(process_batch(intents)))
+        
+        print("\n" + _SEP)
+        print(f"📦 BATCH RESULTS ({len(results)} intents)")
+        print(_SEP)
+        for intent, result in zip(intents, results):
+            if result["success"]:
+                print(f"✅ {result['thread_id']}: {intent[:50]} ({len(result['draft'])} characters)")
+            else:
+                print(f"❌ {result['thread_id']}: {intent[:50]} - {result.get('error', 'Unknown error')}")
+        if not all(result["success"] for result in results):
+            sys.exit(1)
+    elif len(sys.argv) > 1:
         # Process single intent from command line
         user_intent = " ".join(sys.argv[1:])
-        result = asyncio.run(process_mcp_request(user_intent))
+        result = asyncio.run(_closing_checkpointer(process_mcp_request(user_intent)))
         
         if result["success"]:
             print(result["draft"])
@@ -162,4 +204,4 @@ if __name__ == "__main__":
             sys.exit(1)
     else:
         # Start interactive CLI
-        asyncio.run(interactive_cli())
+        asyncio.run(_closing_checkpointer(interactive_cli()))
@@ -1,6 +1,5 @@
 import requests
 import json
-import time
 
 BASE_URL = "http://localhost:8000"
 
@@ -31,11 +30,22 @@ def test_all_endpoints():
             thread_id = resp.json().get('data', {}).get('thread_id')
             print(f"   Thread ID: {thread_id}")
 
-            # Wait a short bit to let the background task start
-            time.sleep(0.5)
-            
-            # 3. Test state endpoint
-            print(f"\n3. Testing GET /state/{thread_id}...")
+            # 3. Follow the run over Server-Sent Events instead of polling
+            print(f"\n3. Testing GET /stream/{thread_id}...")
+            with requests.get(f"{BASE_URL}/stream/{thread_id}", stream=True, timeout=300) as stream_resp:
+                print(f"   Status: {stream_resp.status_code}")
+                for line in stream_resp.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    if event["type"] == "status":
+                        print(f"   Status event: {event['status']}")
+                    else:
+                        state = event.get("state", {})
+                        print(f"   Step: iteration={state.get('iteration_count')} scores={state.get('scores')}")
+
+            # 4. Test state endpoint once the stream has closed
+            print(f"\n4. Testing GET /state/{thread_id}...")
             state_resp = requests.get(f"{BASE_URL}/state/{thread_id}")
             print(f"   Status: {state_resp.status_code}")
             print(f"   Response: {state_resp.text[:500]}...")
@@ -1,47 +1,149 @@
+import os
+# asyncio debug mode (often exported in dev shells) times every callback and records
+# coroutine origins; keep it off so it doesn't skew the workflow timing
+os.environ.pop("PYTHONASYNCIODEBUG", None)
+
 import asyncio
-from graph import graph_app
+import logging
+import sys
+from graph import graph_app, setup_async_checkpointer, close_async_checkpointer
+
+log = logging.getLogger("test_graph_manual")
+
+_FLUSH_EVERY = 4  # Steps buffered at most before writing to stdout
+
+# Output goes to the byte layer of stdout; the fixed (emoji-laden) text is encoded once
+_OUT = sys.stdout.buffer
+_TESTING = "🧪 Testing complete workflow\n".encode()
+_STARTING = "1. Starting graph stream...\n".encode()
+_HALTED = "\n⏸️ Graph halted for human review (as expected when interrupt_before is set).\n".encode()
+_COMPLETED = "\n✅ Graph execution completed (no halts).\n".encode()
+_ITERATION = b"   Iteration: "
+_DRAFT_PREVIEW = b"   Draft preview: "
+_SCORES = b"   Scores: "
+_REVIEWS = b"   Reviews: "
+_node_headers = {}  # node name -> encoded "📦 <node> update:" line
+
+def _emit(data: bytes):
+    sys.stdout.flush()  # Keep ordering with anything printed through the text layer (graph.py)
+    _OUT.write(data)
+    _OUT.flush()
+
+def _node_header(node: str) -> bytes:
+    header = _node_headers.get(node)
+    if header is None:
+        header = _node_headers[node] = f"\n📦 {node} update:\n".encode()
+    return header
+
+async def _print_steps(queue: asyncio.Queue):
+    """Format and print steps off the stream loop, so the graph can run ahead by one step."""
+    buf = []
+    pending = 0  # Node updates in buf
+    while True:
+        step = await queue.get()
+        if step is not None:
+            # Steps are per-node deltas ({node: update}); only the fields a node wrote are shown
+            for node, update in step.items():
+                if not isinstance(update, dict):
+                    continue  # e.g. the "__interrupt__" marker
+                buf.append(_node_header(node))
+                if "iteration_count" in update:
+                    buf += (_ITERATION, f"{update['iteration_count']}\n".encode())
+                if "draft" in update:
+                    buf += (_DRAFT_PREVIEW, f"{update['draft'][:80]}...\n".encode())
+                if "scores" in update:
+                    buf += (_SCORES, f"{update['scores']}\n".encode())
+                if "reviews" in update:
+                    buf += (_REVIEWS, f"{len(update['reviews'])}\n".encode())
+                pending += 1
+        # Write when the buffer is full, nothing else is waiting, or the stream ended
+        if buf and (step is None or queue.empty() or pending >= _FLUSH_EVERY):
+            _emit(b"".join(buf))
+            buf.clear()
+            pending = 0
+        if step is None:
+            return
+
+async def _hand_off(queue: asyncio.Queue, printer: asyncio.Task, item):
+    """Queue `item` for the printer, re-raising its error instead of blocking if it has died."""
+    if not printer.done():
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait({put, printer}, return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return
+        put.cancel()
+    printer.result()
+
+# Shared, never-mutated parts of the starting state; list fields are created fresh per run
+_INITIAL_TEMPLATE = {
+    "user_intent": "Create exercise for test anxiety",
+    "iteration_count": 0,
+    "human_approved": False,
+    "supervisor_feedback": "",
+    "draft": "",
+    "scores": {},
+    "error": None,
+    "metadata": {"source": "test_graph_manual"}
+}
 
 async def test_full_workflow():
-    print("🧪 Testing complete workflow")
+    _emit(_TESTING)
     
     config = {"configurable": {"thread_id": "manual_test_001"}}
+    await setup_async_checkpointer()
     
-    initial_state = {
-        "user_intent": "Create exercise for test anxiety",
-        "iteration_count": 0,
-        "draft_history": [],
-        "human_approved": False,
-        "supervisor_feedback": "",
-        "draft": "",
-        "reviews": [],
-        "scores": {},
-        "error": None,
-        "metadata": {"source": "test_graph_manual"}
-    }
+    initial_state = dict(_INITIAL_TEMPLATE)
+    initial_state["draft_history"] = []
+    initial_state["reviews"] = []
     
     try:
-        print("1. Starting graph stream...")
-        final_state = None
-        async for step in graph_app.astream(initial_state, config, stream_mode="values"):
-            final_state = step
-            print(f"\n📦 Step received:")
-            print(f"   Iteration: {step.get('iteration_count')}")
-            print(f"   Draft preview: {step.get('draft', '')[:80]}...")
-            print(f"   Scores: {step.get('scores', {})}")
-            print(f"   Reviews: {len(step.get('reviews', []))}")
-
-        # Optional: Check snapshot to see if halted
-        snapshot = await graph_app.aget_state(config)
-        next_nodes = getattr(snapshot, "next", [])
-        if next_nodes and "human_review_halt" in next_nodes:
-            print("\n⏸️ Graph halted for human review (as expected when interrupt_before is set).")
+        _emit(_STARTING)
+        final_state = dict(initial_state)  # Rolling view, enough for the halt check below
+        interrupted = False
+        steps: asyncio.Queue = asyncio.Queue(maxsize=1)
+        printer = asyncio.create_task(_print_steps(steps))
+        try:
+            async for step in graph_app.astream(initial_state, config, stream_mode="updates"):
+                for node, update in step.items():
+                    if node == "__interrupt__":
+                        interrupted = True
+                    elif isinstance(update, dict):
+                        final_state.update(update)
+                await _hand_off(steps, printer, step)
+        finally:
+            if not printer.done():
+                await _hand_off(steps, printer, None)
+            await printer
+
+        # The streamed interrupt marker settles it without touching the checkpointer. Only an
+        # unapproved run that streamed no marker (older LangGraph releases) needs the snapshot.
+        halted = interrupted
+        if not halted and not final_state.get("human_approved"):
+            snapshot = await graph_app.aget_state(config)
+            halted = "human_review_halt" in (getattr(snapshot, "next", None) or ())
+        if halted:
+            _emit(_HALTED)
         else:
-            print("\n✅ Graph execution completed (no halts).")
+            _emit(_COMPLETED)
         
     except Exception as e:
-        print(f"❌ Graph failed: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Graph failed: %s", e)
+    finally:
+        await close_async_checkpointer()
 
 if __name__ == "__main__":
-    asyncio.run(test_full_workflow())
+    logging.basicConfig(format="%(message)s")
+    # uvloop (pulled in by uvicorn[standard] outside Windows) cuts per-await scheduling overhead
+    try:
+        import uvloop
+        loop = uvloop.new_event_loop()
+    except ImportError:
+        loop = asyncio.new_event_loop()
+    # Driven by hand rather than asyncio.run: the script has no async generators to
+    # finalize, so the extra shutdown passes are skipped
+    loop.set_debug(False)
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(test_full_workflow())
+    finally:
+        loop.close()